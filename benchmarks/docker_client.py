@@ -0,0 +1,50 @@
+"""Per-call latency of a fresh Docker client versus the shared client
+
+Needs a reachable Docker daemon. Run from the repository root::
+
+    python -m benchmarks.docker_client --calls 200
+"""
+
+import argparse
+import os
+import statistics
+import time
+
+import django
+
+
+def measure(get_client, calls):
+    timings = []
+    for _i in range(calls):
+        start = time.perf_counter()
+        get_client().ping()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def report(name, timings):
+    timings = sorted(timings)
+    print(
+        f"{name:>8}: "
+        f"median {statistics.median(timings) * 1000:.2f} ms, "
+        f"p95 {timings[int(len(timings) * 0.95)] * 1000:.2f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=200)
+    args = parser.parse_args()
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "ctfexam.settings")
+    django.setup()
+
+    import docker
+    from challenges import docker_client
+
+    report("from_env", measure(docker.DockerClient.from_env, args.calls))
+    report("shared", measure(docker_client.get_client, args.calls))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Finding student numbers in writeups: per-number scans versus the index
+
+Run from the repository root::
+
+    python -m benchmarks.roster --students 2000 --writeups 20000
+"""
+
+import argparse
+import random
+import string
+import time
+
+from users.roster import RosterIndex
+
+
+def naive(roster, text, mine):
+    """The scan ``find_student_numbers`` used to do"""
+    text = text.lower()
+    found = [number for number in roster if number != mine and number in text]
+    if found:
+        return found
+    return [number for number in roster if number[1:] in text] or None
+
+
+def indexed(index, text, mine):
+    full, partial = index.matches(text)
+    found = [number for number in full if number != mine]
+    return found or partial or None
+
+
+def make_writeups(roster, count, rng):
+    words = ["".join(rng.choices(string.ascii_lowercase, k=6)) for _i in range(500)]
+    writeups = []
+    for _i in range(count):
+        text = rng.choices(words, k=rng.randint(100, 400))
+        if rng.random() < 0.05:
+            text.insert(rng.randrange(len(text)), rng.choice(roster))
+        writeups.append(" ".join(text))
+    return writeups
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--students", type=int, default=2000)
+    parser.add_argument("--writeups", type=int, default=20000)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    roster = [f"s{rng.randrange(10**7):07d}" for _i in range(args.students)]
+    writeups = make_writeups(roster, args.writeups, rng)
+
+    start = time.perf_counter()
+    index = RosterIndex(roster)
+    built = time.perf_counter()
+    fast = [indexed(index, text, roster[0]) for text in writeups]
+    done = time.perf_counter()
+    print(f" indexed: build {built - start:.2f}s, match {done - built:.2f}s")
+
+    start = time.perf_counter()
+    slow = [naive(roster, text, roster[0]) for text in writeups]
+    print(f"   naive: {time.perf_counter() - start:.2f}s")
+    assert [sorted(r or []) for r in fast] == [sorted(r or []) for r in slow]
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Finding similar writeups: MinHash with LSH versus comparing all pairs
+
+Run from the repository root::
+
+    python -m benchmarks.similarity --writeups 10000 --copies 200
+
+All pairs are only compared for a sample of ``--sample`` writeups; the time
+for all writeups is extrapolated from that, as it grows quadratically.
+"""
+
+import argparse
+import random
+import string
+import time
+from itertools import combinations
+
+from challenges import similarity
+
+
+def make_writeups(count, copies, rng):
+    """Random writeups, with ``copies`` of them lightly edited copies"""
+    words = ["".join(rng.choices(string.ascii_lowercase, k=6)) for _i in range(5000)]
+    writeups = [
+        " ".join(rng.choices(words, k=rng.randint(150, 400)))
+        for _i in range(count - copies)
+    ]
+    planted = set()
+    for _i in range(copies):
+        original = rng.randrange(len(writeups))
+        text = writeups[original].split()
+        for _j in range(len(text) // 20):
+            text[rng.randrange(len(text))] = rng.choice(words)
+        planted.add((original, len(writeups)))
+        writeups.append(" ".join(text))
+    return writeups, planted
+
+
+def jaccard(first, second):
+    return len(first & second) / len(first | second)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--writeups", type=int, default=10000)
+    parser.add_argument("--copies", type=int, default=200)
+    parser.add_argument("--sample", type=int, default=1000)
+    parser.add_argument("--threshold", type=float, default=similarity.THRESHOLD)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    writeups, planted = make_writeups(args.writeups, args.copies, rng)
+
+    start = time.perf_counter()
+    shingle_sets = [similarity.shingles(text) for text in writeups]
+    shingled = time.perf_counter()
+    signatures = similarity.signatures(shingle_sets)
+    hashed = time.perf_counter()
+    pairs = similarity.similar_pairs(dict(enumerate(signatures)), args.threshold)
+    done = time.perf_counter()
+    found = {(first, second) for first, second, _score in pairs}
+    backend = "numpy" if similarity.numpy is not None else "python"
+    print(
+        f"minhash: shingle {shingled - start:.2f}s, "
+        f"hash {hashed - shingled:.2f}s ({backend}), lsh {done - hashed:.2f}s"
+    )
+    print(f"         found {len(found & planted)}/{len(planted)} planted pairs")
+    print(f"         {len(found - planted)} other pairs")
+
+    sample = shingle_sets[: args.sample]
+    start = time.perf_counter()
+    exact = [
+        (i, j)
+        for (i, first), (j, second) in combinations(enumerate(sample), 2)
+        if jaccard(first, second) >= args.threshold
+    ]
+    elapsed = time.perf_counter() - start
+    scale = (len(writeups) / len(sample)) ** 2
+    print(
+        f"  exact: {elapsed:.2f}s for {len(sample)} writeups, "
+        f"about {elapsed * scale:.0f}s for {len(writeups)} ({len(exact)} pairs)"
+    )
+
+
+if __name__ == "__main__":
+    main()
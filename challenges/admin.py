@@ -1,9 +1,11 @@
 """Registers models with the admin site"""
 
 from django.contrib import admin
+from django.template.response import TemplateResponse
+from django.urls import path
 from django.utils import timezone
 
-from . import models
+from . import models, transcripts
 
 
 class IsActiveListFilter(admin.SimpleListFilter):
@@ -31,7 +33,7 @@ class IsActiveListFilter(admin.SimpleListFilter):
 
 @admin.register(models.Challenge)
 class ChallengeAdmin(admin.ModelAdmin):
-    list_display = ("title", "container", "start_time", "end_time")
+    list_display = ("title", "container", "start_time", "end_time", "pool_size")
     list_filter = (IsActiveListFilter,)
 
 
@@ -42,8 +44,98 @@ class ChallengeEntryAdmin(admin.ModelAdmin):
     search_fields = ("user__username", "user__first_name", "user__last_name")
 
 
+@admin.register(models.DockerHost)
+class DockerHostAdmin(admin.ModelAdmin):
+    list_display = ("name", "endpoint", "hostname", "capacity", "enabled")
+    list_filter = ("enabled",)
+
+
 @admin.register(models.ChallengeProcess)
 class ChallengeProcessAdmin(admin.ModelAdmin):
-    list_display = ("__str__", "running", "started")
-    list_filter = ("running",)
-    readonly_fields = ("started", "process_identifier")
+    list_display = ("__str__", "running", "host", "started")
+    list_filter = ("running", "host")
+    readonly_fields = ("started", "process_identifier", "host", "published_ports")
+    actions = ("refresh_ports", "stop_processes")
+
+    @admin.action(description="Look up published ports in Docker")
+    def refresh_ports(self, request, queryset):
+        for process in queryset.filter(running=True):
+            process.refresh_ports()
+
+    @admin.action(description="Stop selected processes")
+    def stop_processes(self, request, queryset):
+        models.ChallengeProcess.stop_many(queryset.filter(running=True))
+
+    def get_urls(self):
+        return [
+            path(
+                "transcripts/",
+                self.admin_site.admin_view(self.search_transcripts),
+                name="challenges_challengeprocess_transcripts",
+            ),
+        ] + super().get_urls()
+
+    def search_transcripts(self, request):
+        """Search the payloads of all ingested transcripts"""
+        query = request.GET.get("q", "")
+        results = []
+        error = None
+        if query:
+            try:
+                with transcripts.TranscriptIndex() as index:
+                    results = index.search(query)
+            except ValueError as e:
+                error = str(e)
+            processes = {
+                process.process_identifier: process
+                for process in models.ChallengeProcess.objects.filter(
+                    process_identifier__in={r.process_identifier for r in results}
+                ).select_related("challenge_entry__user", "challenge_entry__challenge")
+            }
+            results = [
+                (record, processes.get(record.process_identifier)) for record in results
+            ]
+        context = {
+            **self.admin_site.each_context(request),
+            "opts": self.model._meta,
+            "title": "Search transcripts",
+            "query": query,
+            "results": results,
+            "error": error,
+        }
+        return TemplateResponse(
+            request, "admin/challenges/challengeprocess/transcripts.html", context
+        )
+
+
+@admin.register(models.PooledInstance)
+class PooledInstanceAdmin(admin.ModelAdmin):
+    list_display = ("__str__", "host", "created")
+    list_filter = ("challenge__title", "host")
+    readonly_fields = ("created", "process_identifier", "host")
+
+
+@admin.register(models.ChallengeJob)
+class ChallengeJobAdmin(admin.ModelAdmin):
+    list_display = ("__str__", "action", "status", "created", "finished")
+    list_filter = ("action", "status")
+    readonly_fields = ("created", "finished", "error")
+
+
+@admin.register(models.ContainerImage)
+class ContainerImageAdmin(admin.ModelAdmin):
+    list_display = ("reference", "host", "digest", "checked")
+
+
+@admin.register(models.NetworkPair)
+class NetworkPairAdmin(admin.ModelAdmin):
+    list_display = ("__str__", "host", "process_identifier", "leased")
+    readonly_fields = (
+        "host",
+        "internal_id",
+        "internal_name",
+        "public_id",
+        "public_name",
+        "process_identifier",
+        "leased",
+    )
@@ -0,0 +1,247 @@
+"""Admission control for starting processes
+
+Every process reserves CPU, memory and PIDs for its containers and two
+networks. Starts are only handed to the ``process_jobs`` worker while the
+reservations of running processes, pooled instances and starts in progress
+stay within the ``ADMISSION_*`` limits, which count all Docker hosts
+together, and while a registered host has room left. Starts that do not fit
+wait in the queue.
+
+The queue is first come, first served with a fair share per user: a
+user's n-th queued start ranks behind everyone's earlier ones, counting
+the processes the user is already running. If ``ADMISSION_EVICT_IDLE`` is
+set, processes whose transcript has been idle for that long are stopped to
+make room, least recently active first.
+"""
+
+import time
+from collections import Counter
+from dataclasses import dataclass, fields
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+
+from . import logs, models, placement
+
+
+@dataclass(frozen=True)
+class Resources:
+    """What processes reserve on the Docker host"""
+
+    #: Number of CPUs
+    cpu: float = 0
+    #: Bytes
+    memory: int = 0
+    pids: int = 0
+    subnets: int = 0
+
+    def __add__(self, other):
+        return Resources(
+            *(getattr(self, f.name) + getattr(other, f.name) for f in fields(self))
+        )
+
+    def __sub__(self, other):
+        return Resources(
+            *(getattr(self, f.name) - getattr(other, f.name) for f in fields(self))
+        )
+
+    def __mul__(self, count):
+        return Resources(*(getattr(self, f.name) * count for f in fields(self)))
+
+    def fits(self, limits: dict) -> bool:
+        """Whether these resources stay within ``limits``, ``None`` is no limit"""
+        return all(
+            limit is None or getattr(self, name) <= limit
+            for name, limit in limits.items()
+        )
+
+
+def limits() -> dict:
+    return {
+        "cpu": settings.ADMISSION_CPU,
+        "memory": settings.ADMISSION_MEMORY,
+        "pids": settings.ADMISSION_PIDS,
+        "subnets": settings.ADMISSION_SUBNETS,
+    }
+
+
+def process_resources(challenge) -> Resources:
+    """What a process of ``challenge`` reserves
+
+    Proxies have no PID limit and are not counted for PIDs.
+    """
+    proxies = sum(1 for port in challenge.listen_ports if port["logged"])
+    cpu_quota = models.VULN_CPU_QUOTA + proxies * models.PROXY_CPU_QUOTA
+    return Resources(
+        cpu=cpu_quota / models.CPU_PERIOD,
+        memory=models.VULN_MEMORY + proxies * models.PROXY_MEMORY,
+        pids=models.VULN_PIDS,
+        subnets=2,
+    )
+
+
+def _active_per_challenge() -> Counter:
+    """Processes that reserve resources, per challenge id"""
+    counts = Counter()
+    for queryset, field in (
+        (models.ChallengeProcess.running_challenges, "challenge_entry__challenge"),
+        (models.PooledInstance.objects, "challenge"),
+        (
+            models.ChallengeJob.objects.filter(
+                action=models.ChallengeJob.START, status=models.ChallengeJob.RUNNING
+            ),
+            "challenge_entry__challenge",
+        ),
+    ):
+        for challenge_id, count in queryset.values_list(field).annotate(n=Count("pk")):
+            counts[challenge_id] += count
+    return counts
+
+
+def _active_per_user() -> Counter:
+    """Running processes and starts in progress, per user id"""
+    counts = Counter(
+        dict(
+            models.ChallengeProcess.running_challenges.values_list(
+                "challenge_entry__user"
+            ).annotate(n=Count("pk"))
+        )
+    )
+    counts.update(
+        dict(
+            models.ChallengeJob.objects.filter(
+                action=models.ChallengeJob.START, status=models.ChallengeJob.RUNNING
+            )
+            .values_list("challenge_entry__user")
+            .annotate(n=Count("pk"))
+        )
+    )
+    return counts
+
+
+def queue_order(jobs, active=None):
+    """Queued start ``jobs`` in the order they will be admitted"""
+    active = _active_per_user() if active is None else active
+    seen = Counter()
+    ranks = {}
+    for job in sorted(jobs, key=lambda job: (job.created, job.pk)):
+        user = job.challenge_entry.user_id
+        ranks[job.pk] = (active[user] + seen[user], job.created, job.pk)
+        seen[user] += 1
+    return sorted(jobs, key=lambda job: ranks[job.pk])
+
+
+def queued_starts():
+    return list(
+        models.ChallengeJob.objects.filter(
+            action=models.ChallengeJob.START, status=models.ChallengeJob.QUEUED
+        ).select_related("challenge_entry__challenge")
+    )
+
+
+def queue_position(job) -> int:
+    """1-based position of the queued start ``job``"""
+    for position, queued in enumerate(queue_order(queued_starts()), 1):
+        if queued.pk == job.pk:
+            return position
+    return 0
+
+
+def committed(challenges) -> Resources:
+    """Resources reserved right now, given ``{pk: challenge}``"""
+    active = _active_per_challenge()
+    challenges.update(models.Challenge.objects.in_bulk(set(active) - set(challenges)))
+    total = Resources()
+    for challenge_id, count in active.items():
+        total += process_resources(challenges[challenge_id]) * count
+    return total
+
+
+def admit(jobs, limit: int):
+    """The queued start ``jobs`` that may run now, at most ``limit``"""
+    ordered = queue_order(jobs)
+    limit_values = limits()
+    slots = placement.free_slots()
+    if slots is None and all(value is None for value in limit_values.values()):
+        return ordered[:limit]
+
+    challenges = {
+        job.challenge_entry.challenge_id: job.challenge_entry.challenge for job in jobs
+    }
+    usage = committed(challenges)
+    pooled = Counter(
+        dict(
+            models.PooledInstance.objects.values_list("challenge").annotate(
+                n=Count("pk")
+            )
+        )
+    )
+    admitted = []
+    for job in ordered[:limit]:
+        challenge = job.challenge_entry.challenge
+        if pooled[challenge.pk]:
+            # Claims a pooled instance, whose resources are already counted
+            pooled[challenge.pk] -= 1
+            admitted.append(job)
+            continue
+        if slots is not None and slots <= 0:
+            break
+        needed = process_resources(challenge)
+        if not (usage + needed).fits(limit_values):
+            usage = evict(usage, needed, limit_values, challenge)
+            if not (usage + needed).fits(limit_values):
+                # Later starts wait too, so this one is not overtaken
+                break
+        usage += needed
+        if slots is not None:
+            slots -= 1
+        admitted.append(job)
+    return admitted
+
+
+def last_activity(process) -> float:
+    """When the transcript of ``process`` was last written to"""
+    path = logs.find_log(logs.log_root() / process.process_identifier)
+    if path is not None:
+        return path.stat().st_mtime
+    return process.started.timestamp()
+
+
+def evict(usage: Resources, needed: Resources, limit_values, challenge) -> Resources:
+    """Stop idle processes until ``needed`` fits, if eviction is enabled
+
+    Only processes on the host a process of ``challenge`` would be placed on
+    are stopped, as room elsewhere does not help it. Returns the resources
+    reserved afterwards.
+    """
+    idle_after = settings.ADMISSION_EVICT_IDLE
+    if idle_after is None:
+        return usage
+    try:
+        host = placement.place(challenge)
+    except placement.NoCapacity:
+        return usage
+    now = time.time()
+    candidates = sorted(
+        (
+            (last_activity(process), process)
+            for process in models.ChallengeProcess.running_challenges.filter(
+                host=host
+            ).select_related("challenge_entry__challenge")
+        ),
+        key=lambda candidate: candidate[0],
+    )
+    for activity, process in candidates:
+        if (usage + needed).fits(limit_values) or activity > now - idle_after:
+            break
+        # Either the stop is queued and the row is gone, or neither
+        with transaction.atomic():
+            models.ChallengeJob.enqueue_stop(
+                process, challenge_entry=process.challenge_entry
+            )
+            # Already queued, so the delete signal does not need to stop it
+            process.running = False
+            process.delete()
+        usage -= process_resources(process.challenge_entry.challenge)
+    return usage
@@ -0,0 +1,390 @@
+"""Exporting entries for grading
+
+Used by the ``collectresults`` command. Rendering an entry only needs its
+primary key, so entries can be exported by several worker processes while
+one writer puts the files into a directory or a single archive.
+
+Every challenge document is rendered once and written to a shared
+location; entries refer to it with a :class:`Link`.
+
+Worker processes import this module before Django is set up, so models
+are only imported inside functions.
+"""
+
+import hashlib
+import io
+import json
+import os
+import posixpath
+import shutil
+import stat
+import tarfile
+import zipfile
+from pathlib import Path, PurePosixPath
+from tempfile import SpooledTemporaryFile
+from typing import NamedTuple
+
+import django
+from django.conf import settings
+from django.db import connections
+from django.db.models import Prefetch
+from django.template import loader
+from django.utils.text import slugify
+
+from users.roster import get_roster
+
+from . import logs
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def find_student_numbers(text, mine):
+    """Student numbers of others mentioned in ``text``
+
+    Falls back to numbers without their leading letter if no full student
+    numbers are found.
+    """
+    if (roster := get_roster()) is None:
+        return
+    full, partial = roster.matches(text)
+    found = [student_number for student_number in full if student_number != mine]
+    if found:
+        return found
+    if partial:
+        return partial
+
+
+def entry_directory(entry) -> PurePosixPath:
+    """Directory of ``entry`` relative to the output"""
+    user = entry.user
+    full_name = slugify(user.get_full_name())
+    return PurePosixPath(
+        f"{user.student_number}_{full_name}", slugify(entry.challenge.title)
+    )
+
+
+def challenge_document(challenge) -> PurePosixPath:
+    """Shared location of the document of ``challenge``"""
+    return PurePosixPath("challenges", slugify(challenge.title), "challenge.md")
+
+
+class Link(NamedTuple):
+    """Contents of a file that are the same as ``target`` in the output"""
+
+    target: PurePosixPath
+
+
+def export_challenges(entries):
+    """Render the document of every challenge of ``entries`` once
+
+    Returns ``(name, contents)`` pairs like :func:`export_entry`.
+    """
+    from .models import Challenge
+
+    template = loader.get_template("challenges/collect/challenge.md")
+    challenges = Challenge.objects.filter(pk__in=entries.values("challenge"))
+    return [
+        (
+            challenge_document(challenge),
+            template.render({"challenge": challenge}).encode(),
+        )
+        for challenge in challenges.order_by("pk")
+    ]
+
+
+def entry_logs(entry):
+    """The ``(number, path)`` of every process log of ``entry``
+
+    Logs may be compressed, read them with :func:`~challenges.logs.open_log`.
+
+    ``entry`` must come from :func:`export_queryset`, which orders its
+    processes.
+    """
+    logdir = logs.log_root()
+    found = []
+    for num, proc in enumerate(entry.challengeprocess_set.all()):
+        logfile = logs.find_log(logdir / proc.process_identifier)
+        if logfile is not None:
+            found.append((num, logfile))
+    return found
+
+
+def entry_fingerprint(entry, log_files) -> str:
+    """Hash of everything the export of ``entry`` depends on
+
+    Logs are only represented by their modification time, which stays the
+    same when they are compressed.
+    """
+    user = entry.user
+    challenge = entry.challenge
+    state = {
+        "writeup": entry.writeup,
+        "completion_time": str(entry.completion_time),
+        "settings": entry.settings,
+        "user": [user.student_number, user.get_full_name()],
+        "challenge": [challenge.title, challenge.description, challenge.solution],
+        "logs": [
+            [num, path.parent.name, path.stat().st_mtime_ns] for num, path in log_files
+        ],
+    }
+    return hashlib.sha256(json.dumps(state, sort_keys=True).encode()).hexdigest()
+
+
+def export_entry(entry):
+    """The fingerprint and files of ``entry``
+
+    Files are ``(name, contents)`` pairs. Contents are either bytes, the
+    :class:`~pathlib.Path` of a (possibly compressed) log file, so large
+    logs can be streamed by the writer, or a :class:`Link` to the challenge
+    document.
+    """
+    writeup_template = loader.get_template("challenges/collect/writeup.md")
+    user = entry.user
+    challenge_dir = entry_directory(entry)
+    log_files = entry_logs(entry)
+
+    partners = None
+    if entry.writeup:
+        partners = find_student_numbers(entry.writeup, user.student_number)
+
+    files = [
+        (challenge_dir / "challenge.md", Link(challenge_document(entry.challenge))),
+        (
+            challenge_dir / "writeup.md",
+            writeup_template.render(
+                {
+                    "entry": entry,
+                    "settings": json.dumps(entry.settings, indent=2),
+                    "user": user,
+                    "partners": partners,
+                }
+            ).encode(),
+        ),
+    ]
+    if partners is not None:
+        files.append((challenge_dir / "partners.txt", "\n".join(partners).encode()))
+
+    for num, logfile in log_files:
+        files.append((challenge_dir / f"log-{num}.log", logfile))
+    return entry_fingerprint(entry, log_files), files
+
+
+def export_queryset(entries=None):
+    """``entries`` with everything the export needs fetched up front
+
+    Exporting any number of entries then takes the same number of queries.
+    """
+    from .models import ChallengeEntry, ChallengeProcess
+
+    if entries is None:
+        entries = ChallengeEntry.objects.all()
+    processes = ChallengeProcess.objects.order_by("started", "process_identifier")
+    return (
+        entries.select_related("user", "challenge")
+        .prefetch_related(Prefetch("challengeprocess_set", queryset=processes))
+        .order_by("pk")
+    )
+
+
+def export_entries(pks):
+    """Export the entries with primary keys ``pks``
+
+    Returns ``(pk, fingerprint, files)`` for every entry.
+    """
+    from .models import ChallengeEntry
+
+    return [
+        (entry.pk, *export_entry(entry))
+        for entry in export_queryset(ChallengeEntry.objects.filter(pk__in=pks))
+    ]
+
+
+class Manifest:
+    """What a previous export wrote for every entry
+
+    Stored next to the export, so the next run only needs to export
+    entries whose fingerprint changed.
+    """
+
+    FILENAME = "manifest.json"
+
+    def __init__(self, entries=None):
+        #: Maps entry primary keys (as strings) to fingerprint and files
+        self.entries = entries or {}
+
+    @classmethod
+    def load(cls, directory: Path):
+        try:
+            with open(directory / cls.FILENAME) as f:
+                return cls(json.load(f)["entries"])
+        except FileNotFoundError:
+            return cls()
+
+    def save(self, directory: Path):
+        path = directory / self.FILENAME
+        tmp = path.with_suffix(".tmp")
+        with open(tmp, "w") as f:
+            json.dump({"entries": self.entries}, f)
+        tmp.replace(path)
+
+    def is_current(self, pk, fingerprint) -> bool:
+        record = self.entries.get(str(pk))
+        return record is not None and record["fingerprint"] == fingerprint
+
+    def files(self, pk):
+        record = self.entries.get(str(pk))
+        return set(record["files"]) if record is not None else set()
+
+    def record(self, pk, fingerprint, names):
+        self.entries[str(pk)] = {"fingerprint": fingerprint, "files": sorted(names)}
+
+    def forget(self, pk):
+        """Drop ``pk`` from the manifest and return the files it had"""
+        files = self.files(pk)
+        self.entries.pop(str(pk), None)
+        return files
+
+
+def setup_worker(database, media_root):
+    """Initialise a spawned worker process
+
+    Workers read the settings afresh, so they are given the database and
+    media root the parent actually uses, e.g. the test database.
+    """
+    django.setup()
+    connections["default"].settings_dict["NAME"] = database
+    settings.MEDIA_ROOT = media_root
+
+
+class DirectoryWriter:
+    """Write exported files into a directory"""
+
+    def __init__(self, root: Path):
+        self.root = root
+
+    def add(self, name: PurePosixPath, contents):
+        path = self.root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if isinstance(contents, Link):
+            path.unlink(missing_ok=True)
+            try:
+                os.link(self.root / contents.target, path)
+            except OSError:
+                # Not every file system supports hardlinks
+                shutil.copyfile(self.root / contents.target, path)
+        elif isinstance(contents, Path):
+            with logs.open_log(contents) as src, open(path, "wb") as dst:
+                shutil.copyfileobj(src, dst)
+        else:
+            # Rewrites in place, so hardlinks to the file see the new contents
+            path.write_bytes(contents)
+
+    def remove(self, name):
+        """Remove a previously written file and empty directories above it"""
+        path = self.root / name
+        path.unlink(missing_ok=True)
+        for parent in path.parents:
+            if parent == self.root or any(parent.iterdir()):
+                break
+            parent.rmdir()
+
+    def close(self):
+        pass
+
+
+class ZipWriter:
+    """Stream exported files into a zip archive"""
+
+    def __init__(self, path: Path):
+        self.archive = zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED)
+
+    def add(self, name: PurePosixPath, contents):
+        if isinstance(contents, Link):
+            # Zip files have no hardlinks, store a relative symlink instead
+            info = zipfile.ZipInfo(str(name))
+            info.external_attr = (stat.S_IFLNK | 0o777) << 16
+            target = posixpath.relpath(contents.target, name.parent)
+            self.archive.writestr(info, target)
+        elif isinstance(contents, Path):
+            with logs.open_log(contents) as src, self.archive.open(
+                str(name), "w", force_zip64=True
+            ) as dst:
+                shutil.copyfileobj(src, dst)
+        else:
+            self.archive.writestr(str(name), contents)
+
+    def close(self):
+        self.archive.close()
+
+
+#: Bytes of a decompressed log kept in memory before spooling to disk
+SPOOL_SIZE = 16 * 1024 * 1024
+
+
+class TarWriter:
+    """Stream exported files into a (compressed) tar archive"""
+
+    def __init__(self, path: Path):
+        self.stream = None
+        self.file = open(path, "wb")
+        if path.name.endswith(".tar.zst"):
+            self.stream = zstandard.ZstdCompressor().stream_writer(self.file)
+            self.archive = tarfile.open(fileobj=self.stream, mode="w|")
+        else:
+            compression = path.suffix.lstrip(".") if path.suffix != ".tar" else ""
+            self.archive = tarfile.open(fileobj=self.file, mode=f"w|{compression}")
+
+    def add(self, name: PurePosixPath, contents):
+        info = tarfile.TarInfo(str(name))
+        if isinstance(contents, Link):
+            info.type = tarfile.LNKTYPE
+            info.linkname = str(contents.target)
+            self.archive.addfile(info)
+        elif isinstance(contents, Path):
+            info.mtime = contents.stat().st_mtime
+            if logs.is_compressed(contents):
+                # Tar needs the size up front, so decompress into a spool
+                with logs.open_log(contents) as src, SpooledTemporaryFile(
+                    max_size=SPOOL_SIZE
+                ) as spool:
+                    shutil.copyfileobj(src, spool)
+                    info.size = spool.tell()
+                    spool.seek(0)
+                    self.archive.addfile(info, spool)
+            else:
+                info.size = contents.stat().st_size
+                with open(contents, "rb") as f:
+                    self.archive.addfile(info, f)
+        else:
+            info.size = len(contents)
+            self.archive.addfile(info, io.BytesIO(contents))
+
+    def close(self):
+        self.archive.close()
+        if self.stream is not None:
+            self.stream.close()
+        self.file.close()
+
+
+#: Archive formats by file name ending
+ARCHIVE_WRITERS = {
+    ".zip": ZipWriter,
+    ".tar": TarWriter,
+    ".tar.gz": TarWriter,
+    ".tar.bz2": TarWriter,
+    ".tar.xz": TarWriter,
+    ".tar.zst": TarWriter,
+}
+
+
+def open_archive(path: Path):
+    """Open a writer for the archive at ``path``, based on its extension"""
+    for ending, writer in ARCHIVE_WRITERS.items():
+        if path.name.endswith(ending):
+            if ending == ".tar.zst" and zstandard is None:
+                raise ValueError("Writing .tar.zst archives needs zstandard")
+            return writer(path)
+    raise ValueError(f"Unknown archive format: {path.name}")
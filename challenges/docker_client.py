@@ -0,0 +1,66 @@
+"""Shared Docker clients per worker process
+
+Creating a :class:`docker.DockerClient` sets up a new connection pool to the
+daemon, so doing that for every page view or stop is wasteful. Instead each
+process keeps a single client with a bounded pool per Docker host. uWSGI
+forks its workers from the master, and sockets must not be shared between
+processes, so clients created before the fork are replaced in the child.
+
+Processes without a :class:`~challenges.models.DockerHost`, and hosts
+without an endpoint, use the daemon configured in the environment.
+"""
+
+import logging
+import os
+import threading
+
+import docker
+from django.conf import settings
+
+#: Logger instance
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_clients = {}
+_clients_pid = None
+
+
+def _endpoint(host) -> str:
+    return host.endpoint if host is not None else ""
+
+
+def get_client(host=None) -> docker.DockerClient:
+    """Get the Docker client of this process for ``host``"""
+    global _clients_pid
+    endpoint = _endpoint(host)
+    with _lock:
+        if _clients_pid != os.getpid():
+            _clients.clear()
+            _clients_pid = os.getpid()
+        if endpoint not in _clients:
+            if endpoint:
+                _clients[endpoint] = docker.DockerClient(
+                    base_url=endpoint, max_pool_size=settings.DOCKER_MAX_POOL_SIZE
+                )
+            else:
+                _clients[endpoint] = docker.DockerClient.from_env(
+                    max_pool_size=settings.DOCKER_MAX_POOL_SIZE
+                )
+        return _clients[endpoint]
+
+
+def reset_client(host=None):
+    """Drop the client of ``host``, for example after the daemon restarted
+
+    Connections that the daemon closed are replaced by the pool on their
+    own; this is for when the client itself ended up in a bad state.
+    """
+    with _lock:
+        if _clients_pid != os.getpid():
+            return
+        client = _clients.pop(_endpoint(host), None)
+        if client is not None:
+            try:
+                client.close()
+            except Exception:
+                logger.exception("Closing the Docker client failed")
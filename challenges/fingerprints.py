@@ -0,0 +1,119 @@
+"""Finding students who sent the same exploit payloads
+
+Payloads differ between students even if they share an exploit, because
+``buffer_padding`` and ``memory_padding`` are random per entry. Every line
+a student sent (``->``) is therefore normalised: hex lines are decoded and
+runs of a repeated byte, the padding, are collapsed. The fingerprint of a
+transcript is the set of 64-bit hashes of its normalised lines.
+
+An inverted index from line hash to students then finds pairs of students
+of the same challenge that sent identical normalised payloads. Lines sent
+by many students (common inputs, the intended solution) are ignored.
+All logs are read in a single streaming pass.
+"""
+
+import hashlib
+import re
+from collections import defaultdict
+from dataclasses import dataclass, field
+from itertools import combinations
+
+from . import logs, transcripts
+
+#: Repeated bytes that are collapsed, like the padding before a return address
+PADDING = re.compile(rb"(.)\1{3,}", re.DOTALL)
+
+#: Normalised lines shorter than this are too common to mean anything
+MIN_LENGTH = 6
+
+#: Lines sent by more students than this are ignored
+MAX_STUDENTS = 3
+
+
+def normalize(payload: bytes):
+    """Normalised form of a sent line, or ``None`` if it is too short"""
+    payload = PADDING.sub(rb"\1*", payload.rstrip(b"\r\n"))
+    return payload if len(payload) >= MIN_LENGTH else None
+
+
+def line_hash(payload: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(payload, digest_size=8).digest(), "big")
+
+
+def fingerprint(file, examples=None):
+    """Hashes of the normalised lines sent in the transcript ``file``
+
+    If ``examples`` is a dict, it maps every new hash to its normalised line.
+    """
+    hashes = set()
+    for line in file:
+        parsed = transcripts.parse_line(line)
+        if parsed is None or parsed[0] != "->":
+            continue
+        if (payload := normalize(parsed[2])) is None:
+            continue
+        value = line_hash(payload)
+        hashes.add(value)
+        if examples is not None:
+            examples.setdefault(value, payload)
+    return hashes
+
+
+@dataclass
+class Match:
+    """Two students of a challenge who sent the same payloads"""
+
+    challenge_id: int
+    users: tuple
+    #: Normalised payloads both sent
+    payloads: list = field(default_factory=list)
+
+
+def scan(logdir=None):
+    """Fingerprints of all transcripts per ``(challenge id, user id)``
+
+    Also returns an example normalised line for every hash.
+    """
+    from .models import ChallengeProcess
+
+    owners = {
+        process_identifier: (challenge_id, user_id)
+        for process_identifier, challenge_id, user_id in ChallengeProcess.objects.values_list(
+            "process_identifier",
+            "challenge_entry__challenge_id",
+            "challenge_entry__user_id",
+        )
+    }
+    fingerprints = defaultdict(set)
+    examples = {}
+    for process_identifier, path in transcripts.transcript_logs(logdir):
+        if (owner := owners.get(process_identifier)) is None:
+            continue
+        with logs.open_log(path) as f:
+            fingerprints[owner] |= fingerprint(f, examples)
+    return fingerprints, examples
+
+
+def find_matches(fingerprints, examples, max_students=MAX_STUDENTS):
+    """Pairs of students of the same challenge that share payloads
+
+    Returns :class:`Match` objects, the most shared payloads first.
+    """
+    index = defaultdict(set)
+    for (challenge_id, user_id), hashes in fingerprints.items():
+        for value in hashes:
+            index[challenge_id, value].add(user_id)
+
+    matches = {}
+    for (challenge_id, value), users in index.items():
+        if len(users) > max_students:
+            continue
+        for pair in combinations(sorted(users), 2):
+            key = (challenge_id, pair)
+            if key not in matches:
+                matches[key] = Match(challenge_id, pair)
+            matches[key].payloads.append(examples[value])
+    return sorted(
+        matches.values(),
+        key=lambda match: (match.challenge_id, -len(match.payloads), match.users),
+    )
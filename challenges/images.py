@@ -0,0 +1,109 @@
+"""Avoid registry round-trips when launching challenges
+
+The digest of every image we use is recorded in :class:`~challenges.models.ContainerImage`.
+While that record is younger than ``IMAGE_CACHE_TTL`` seconds launches use
+the local image without talking to the registry at all. Older records are
+refreshed in a background thread, which only pulls if the digest in the
+registry differs from the one we have. Every Docker host has its own
+records, as it has its own copy of the image.
+"""
+
+import logging
+import threading
+from datetime import timedelta
+
+import docker
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from . import models
+
+#: Logger instance
+logger = logging.getLogger(__name__)
+
+#: Images that are currently being refreshed by this process
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+
+def _reference(name: str, tag: str) -> str:
+    return f"{name}:{tag}"
+
+
+def _local_digests(client, reference: str):
+    """Digests of the local copy of ``reference``, or None if it is missing"""
+    try:
+        image = client.images.get(reference)
+    except docker.errors.ImageNotFound:
+        return None
+    return {digest.split("@", 1)[-1] for digest in image.attrs.get("RepoDigests", [])}
+
+
+def refresh_image(client, name: str, tag: str = "latest", host=None) -> bool:
+    """Pull ``name:tag`` to ``host`` only if the registry has a different digest
+
+    Returns whether the image was pulled.
+    """
+    reference = _reference(name, tag)
+    digest = client.images.get_registry_data(reference).id
+    local = _local_digests(client, reference)
+    pulled = local is None or digest not in local
+    if pulled:
+        logger.info("Pulling %s (%s)", reference, digest)
+        client.images.pull(name, tag=tag)
+    models.ContainerImage.objects.update_or_create(
+        reference=reference,
+        host=host,
+        defaults={"digest": digest, "checked": timezone.now()},
+    )
+    return pulled
+
+
+def _refresh_in_background(client, name: str, tag: str, host):
+    reference = _reference(name, tag)
+    key = (host.pk if host is not None else None, reference)
+    with _refreshing_lock:
+        if key in _refreshing:
+            return
+        _refreshing.add(key)
+
+    def refresh():
+        try:
+            refresh_image(client, name, tag, host)
+        except docker.errors.APIError:
+            logger.exception("Refreshing %s on %s failed", reference, host)
+        finally:
+            with _refreshing_lock:
+                _refreshing.discard(key)
+            connection.close()
+
+    threading.Thread(target=refresh, daemon=True).start()
+
+
+def ensure_image(client, name: str, tag: str = "latest", host=None):
+    """Make sure ``name:tag`` is available on ``host`` for starting containers
+
+    Only blocks on the registry if we have never seen the image there.
+    """
+    reference = _reference(name, tag)
+    record = models.ContainerImage.objects.filter(
+        reference=reference, host=host
+    ).first()
+    if record is None:
+        if _local_digests(client, reference) is None:
+            refresh_image(client, name, tag, host)
+        else:
+            _refresh_in_background(client, name, tag, host)
+        return
+    if timezone.now() - record.checked > timedelta(seconds=settings.IMAGE_CACHE_TTL):
+        _refresh_in_background(client, name, tag, host)
+
+
+def hosts_with_image(name: str, tag: str = "latest") -> set:
+    """Ids of the Docker hosts that have pulled ``name:tag``"""
+    return set(
+        models.ContainerImage.objects.filter(
+            reference=_reference(name, tag), host__isnull=False
+        ).values_list("host", flat=True)
+    )
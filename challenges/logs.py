@@ -0,0 +1,173 @@
+"""Lifecycle of the per-process log directories
+
+Every process gets ``MEDIA_ROOT/logs/<process>``, where its proxies append
+to ``challenge.log`` and ``socat.log``. Once a process is stopped, its logs
+no longer change, so they are compressed with gzip. Old directories are
+removed according to ``LOG_MAX_AGE`` and ``LOG_MAX_TOTAL_SIZE``.
+
+Code reading logs should use :func:`find_log` and :func:`open_log`, which
+handle both plain and compressed logs.
+"""
+
+import gzip
+import os
+import shutil
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+from django.conf import settings
+
+#: Logs the proxy containers write
+LOG_NAMES = ("challenge.log", "socat.log")
+
+#: Suffix of compressed logs
+COMPRESSED_SUFFIX = ".gz"
+
+
+def log_root() -> Path:
+    return settings.MEDIA_ROOT / "logs"
+
+
+def find_log(directory: Path, name="challenge.log"):
+    """Path of the log ``name`` in ``directory``, compressed or not
+
+    Returns ``None`` if there is no such log.
+    """
+    for path in (directory / name, directory / f"{name}{COMPRESSED_SUFFIX}"):
+        if path.exists():
+            return path
+    return None
+
+
+def is_compressed(path: Path) -> bool:
+    return path.name.endswith(COMPRESSED_SUFFIX)
+
+
+def open_log(path: Path):
+    """Open a log for reading bytes, decompressing it while reading"""
+    if is_compressed(path):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+def compress(path: Path) -> int:
+    """Replace the log at ``path`` with a compressed copy
+
+    Keeps the modification time. Returns the number of bytes saved.
+    """
+    target = path.with_name(path.name + COMPRESSED_SUFFIX)
+    tmp = target.with_name(target.name + ".tmp")
+    stat = path.stat()
+    with open(path, "rb") as src, gzip.open(tmp, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.utime(tmp, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    tmp.replace(target)
+    path.unlink()
+    return stat.st_size - target.stat().st_size
+
+
+@dataclass
+class LogDirectory:
+    """A log directory and what is on disk"""
+
+    path: Path
+    size: int
+    #: Modification time of the most recently written file
+    modified: float
+
+    @classmethod
+    def scan(cls, path: Path):
+        size = 0
+        modified = None
+        for entry in os.scandir(path):
+            if entry.is_file(follow_symlinks=False):
+                stat = entry.stat(follow_symlinks=False)
+                size += stat.st_size
+                modified = max(modified or 0, stat.st_mtime)
+        if modified is None:
+            # Compressing changes the directory, so only use it if it is empty
+            modified = path.stat().st_mtime
+        return cls(path, size, modified)
+
+    def remove(self, result):
+        shutil.rmtree(self.path)
+        result.removed += 1
+        result.freed += self.size
+
+
+@dataclass
+class LifecycleResult:
+    compressed: int = 0
+    saved: int = 0
+    removed: int = 0
+    freed: int = 0
+
+
+def active_identifiers():
+    """Identifiers of processes whose proxies may still write logs"""
+    from .models import ChallengeProcess, PooledInstance
+
+    running = ChallengeProcess.running_challenges.values_list(
+        "process_identifier", flat=True
+    )
+    pooled = PooledInstance.objects.values_list("process_identifier", flat=True)
+    return set(running) | set(pooled)
+
+
+def apply_lifecycle(now=None) -> LifecycleResult:
+    """Compress and expire the logs of processes that are no longer running
+
+    Directories only count as stopped once nothing was written to them for
+    ``LOG_COMPRESS_AFTER`` seconds, which also covers processes that are
+    still starting and have no database row yet. Logs of active processes
+    count towards ``LOG_MAX_TOTAL_SIZE``, but are never touched. Without
+    ``LOG_COMPRESS_AFTER``, logs are only expired.
+    """
+    now = time.time() if now is None else now
+    result = LifecycleResult()
+    root = log_root()
+    if not root.is_dir():
+        return result
+
+    compress_after = settings.LOG_COMPRESS_AFTER
+    active = active_identifiers()
+    directories = [LogDirectory.scan(path) for path in root.iterdir() if path.is_dir()]
+    total = sum(directory.size for directory in directories)
+    stopped = sorted(
+        (
+            directory
+            for directory in directories
+            if directory.path.name not in active
+            and directory.modified < now - (compress_after or 0)
+        ),
+        key=lambda directory: directory.modified,
+    )
+
+    max_age = settings.LOG_MAX_AGE
+    kept = []
+    for directory in stopped:
+        if max_age is not None and directory.modified < now - max_age:
+            directory.remove(result)
+            total -= directory.size
+            continue
+        kept.append(directory)
+        if compress_after is None:
+            continue
+        for name in LOG_NAMES:
+            path = directory.path / name
+            if path.exists():
+                saved = compress(path)
+                directory.size -= saved
+                total -= saved
+                result.compressed += 1
+                result.saved += saved
+
+    # Oldest first
+    max_total = settings.LOG_MAX_TOTAL_SIZE
+    for directory in kept:
+        if max_total is None or total <= max_total:
+            break
+        directory.remove(result)
+        total -= directory.size
+    return result
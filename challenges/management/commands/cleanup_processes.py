@@ -9,8 +9,11 @@ class Command(BaseCommand):
     help = "Cleans up no-longer running procesess"
 
     def handle(self, *args, **kwargs):
-        for process in models.ChallengeProcess.running_challenges.all():
-            if timezone.now() - process.started > timedelta(hours=12):
-                process.stop()
+        models.ChallengeProcess.stop_many(
+            models.ChallengeProcess.running_challenges.filter(
+                started__lt=timezone.now() - timedelta(hours=12)
+            )
+        )
 
         models.ChallengeProcess.cleanup()
+        models.NetworkPair.reap()
@@ -1,76 +1,202 @@
-from datetime import timedelta
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime
+from itertools import islice
 from pathlib import Path
-import json
-import shutil
+import multiprocessing
 
+from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
-from django.template import loader
+from django.db import connections
 from django.utils import timezone
-from django.utils.text import slugify
-from django.conf import settings
+from django.utils.dateparse import parse_date, parse_datetime
 
+from challenges import collect
 from challenges.models import ChallengeEntry
 
 
-def find_student_numbers(text, mine):
-    text = text.lower()
-    found = []
-    if settings.VALID_STUDENT_NUMBERS is None:
-        return
-    for student_number in settings.VALID_STUDENT_NUMBERS:
-        if student_number != mine and student_number in text:
-            found.append(student_number)
-    if found:
-        return found
-    # try again without leading letter
-    for student_number in settings.VALID_STUDENT_NUMBERS:
-        if student_number[1:] in text:
-            found.append(student_number)
-    if found:
-        return found
+def parse_time(value):
+    """Parse a date or date and time given on the command line"""
+    time = parse_datetime(value)
+    if time is None and (date := parse_date(value)) is not None:
+        time = datetime.combine(date, datetime.min.time())
+    if time is None:
+        raise ValueError(value)
+    if timezone.is_naive(time):
+        time = timezone.make_aware(time)
+    return time
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
 
 
 class Command(BaseCommand):
     help = "Collect results for students"
 
-    def handle(self, *args, **kwargs):
-        logdir = settings.MEDIA_ROOT / "logs"
-        base_dir = Path("challenges/collect")
-        writeup_template = loader.get_template(base_dir / "writeup.md")
-        challenge_template = loader.get_template(base_dir / "challenge.md")
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--jobs",
+            type=int,
+            default=1,
+            help="Number of processes exporting entries",
+        )
+        parser.add_argument(
+            "--archive",
+            type=Path,
+            help="Write into this archive (.zip, .tar, .tar.gz, .tar.zst, ...)",
+        )
+        parser.add_argument(
+            "--incremental",
+            action="store_true",
+            help="Only export entries that changed since the previous export",
+        )
+        parser.add_argument(
+            "--challenge",
+            type=int,
+            action="append",
+            help="Only export entries of the challenge with this id",
+        )
+        parser.add_argument(
+            "--user",
+            action="append",
+            help="Only export entries of the user with this username",
+        )
+        parser.add_argument(
+            "--completed-after",
+            type=parse_time,
+            help="Only export entries completed at or after this time",
+        )
+        parser.add_argument(
+            "--completed-before",
+            type=parse_time,
+            help="Only export entries completed before this time",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=50,
+            help="Number of entries a worker exports at a time",
+        )
+
+    def handle(
+        self,
+        *args,
+        jobs,
+        archive,
+        incremental,
+        challenge,
+        user,
+        completed_after,
+        completed_before,
+        chunk_size,
+        **kwargs,
+    ):
+        self.manifest = None
         output_dir = Path("collected")
-        for entry in ChallengeEntry.objects.all():
-            user = entry.user
-            full_name = slugify(user.get_full_name())
-            user_dir = output_dir / f"{user.student_number}_{full_name}"
-            challenge_dir = user_dir / slugify(entry.challenge.title)
-            challenge_dir.mkdir(parents=True)
-
-            partners = None
-            if entry.writeup:
-                partners = find_student_numbers(entry.writeup, user.student_number)
-
-            with open(challenge_dir / "challenge.md", "w") as f:
-                f.write(challenge_template.render({"challenge": entry.challenge}))
-            with open(challenge_dir / "writeup.md", "w") as f:
-                f.write(
-                    writeup_template.render(
-                        {
-                            "entry": entry,
-                            "settings": json.dumps(entry.settings, indent=2),
-                            "user": user,
-                            "partners": partners,
-                        }
-                    )
+        if archive is not None:
+            if incremental:
+                raise CommandError("Incremental exports need a directory")
+            try:
+                self.writer = collect.open_archive(archive)
+            except ValueError as e:
+                raise CommandError(e)
+        else:
+            if output_dir.exists() and not incremental:
+                raise CommandError(
+                    f"{output_dir} already exists, use --incremental to update it"
                 )
+            self.writer = collect.DirectoryWriter(output_dir)
+            self.manifest = collect.Manifest.load(output_dir)
+
+        entries = ChallengeEntry.objects.all()
+        if challenge:
+            entries = entries.filter(challenge__in=challenge)
+        if user:
+            entries = entries.filter(user__username__in=user)
+        if completed_after is not None:
+            entries = entries.filter(completion_time__gte=completed_after)
+        if completed_before is not None:
+            entries = entries.filter(completion_time__lt=completed_before)
+        entries = collect.export_queryset(entries)
+
+        try:
+            # Entries link to these, so they have to be written first
+            for name, contents in collect.export_challenges(entries):
+                self.writer.add(name, contents)
+            if incremental:
+                pks = self.changed_entries(entries, chunk_size)
+            elif jobs == 1:
+                # Nothing to hand out to workers, export straight from the query
+                for entry in entries.iterator(chunk_size=chunk_size):
+                    self.write([(entry.pk, *collect.export_entry(entry))])
+                return
+            else:
+                pks = entries.values_list("pk", flat=True).iterator()
+            chunks = chunked(pks, chunk_size)
+            if jobs > 1:
+                self.export_parallel(chunks, jobs)
+            else:
+                for chunk in chunks:
+                    self.write(collect.export_entries(chunk))
+        finally:
+            self.writer.close()
+            if self.manifest is not None:
+                output_dir.mkdir(exist_ok=True)
+                self.manifest.save(output_dir)
+
+    def changed_entries(self, entries, chunk_size):
+        """Primary keys of entries whose export is out of date
+
+        Also removes the files of entries that no longer exist. Entries left
+        out by the filters keep their files.
+        """
+        changed = []
+        for entry in entries.iterator(chunk_size=chunk_size):
+            fingerprint = collect.entry_fingerprint(entry, collect.entry_logs(entry))
+            if not self.manifest.is_current(entry.pk, fingerprint):
+                changed.append(entry.pk)
+        existing = ChallengeEntry.objects.filter(pk__in=list(self.manifest.entries))
+        current = {str(pk) for pk in existing.values_list("pk", flat=True)}
+        for pk in set(self.manifest.entries) - current:
+            for name in self.manifest.forget(pk):
+                self.writer.remove(name)
+        self.stdout.write(f"Exporting {len(changed)} changed entries")
+        return changed
+
+    def write(self, exported):
+        for pk, fingerprint, files in exported:
+            for name, contents in files:
+                self.writer.add(name, contents)
+            if self.manifest is not None:
+                names = {str(name) for name, _contents in files}
+                for stale in self.manifest.files(pk) - names:
+                    self.writer.remove(stale)
+                self.manifest.record(pk, fingerprint, names)
 
-            if partners is not None:
-                with open(challenge_dir / "partners.txt", "w") as f:
-                    f.write("\n".join(partners))
+    def export_parallel(self, chunks, jobs):
+        """Export chunks in worker processes, writing results as they come
 
-            for num, proc in enumerate(
-                entry.challengeprocess_set.order_by("started", "process_identifier")
-            ):
-                logfile = logdir / proc.process_identifier / "challenge.log"
-                if logfile.exists():
-                    shutil.copyfile(logfile, challenge_dir / f"log-{num}.log")
+        At most two chunks per worker are in flight, so memory use does not
+        grow with the number of entries.
+        """
+        # Spawned workers do not share our database connection
+        with ProcessPoolExecutor(
+            max_workers=jobs,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=collect.setup_worker,
+            initargs=(
+                connections["default"].settings_dict["NAME"],
+                settings.MEDIA_ROOT,
+            ),
+        ) as executor:
+            pending = set()
+            for chunk in chunks:
+                pending.add(executor.submit(collect.export_entries, chunk))
+                if len(pending) >= 2 * jobs:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self.write(future.result())
+            for future in pending:
+                self.write(future.result())
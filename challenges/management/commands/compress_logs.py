@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from challenges import logs
+
+
+class Command(BaseCommand):
+    help = "Compresses the logs of stopped processes and removes old logs"
+
+    def handle(self, *args, **kwargs):
+        result = logs.apply_lifecycle()
+        self.stdout.write(
+            f"Compressed {result.compressed} logs, saving {result.saved} bytes"
+        )
+        self.stdout.write(
+            f"Removed {result.removed} log directories, freeing {result.freed} bytes"
+        )
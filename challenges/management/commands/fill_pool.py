@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from challenges import models, placement
+
+
+class Command(BaseCommand):
+    help = "Prepares warm pool instances for available challenges"
+
+    def handle(self, *args, **kwargs):
+        for host in placement.hosts():
+            created = models.NetworkPair.fill(host=host)
+            if created:
+                self.stdout.write(
+                    f"Prepared {created} network pairs on {host or 'the default host'}"
+                )
+
+        available = models.Challenge.available.all()
+        for challenge in available:
+            models.PooledInstance.drain(challenge, keep=challenge.pool_size)
+            created = models.PooledInstance.fill(challenge)
+            if created:
+                self.stdout.write(f"Prepared {created} instances for {challenge}")
+
+        # Challenges that are no longer (or not yet) available keep no pool
+        for challenge in (
+            models.Challenge.objects.exclude(pk__in=available.values("pk"))
+            .filter(pooledinstance__isnull=False)
+            .distinct()
+        ):
+            models.PooledInstance.drain(challenge)
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from challenges import transcripts
+
+
+class Command(BaseCommand):
+    help = "Adds new lines of exam-proxy transcripts to the search index"
+
+    def handle(self, *args, **kwargs):
+        with transcripts.TranscriptIndex() as index:
+            count = transcripts.ingest_all(index)
+        self.stdout.write(f"Ingested {count} transcript lines")
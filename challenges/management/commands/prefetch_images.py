@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.utils import timezone
+from challenges import docker_client, images, models, placement
+
+
+class Command(BaseCommand):
+    help = "Pulls the images of current and upcoming challenges if they changed"
+
+    def handle(self, *args, **kwargs):
+        names = {settings.PROXY_CONTAINER}
+        for challenge in models.Challenge.objects.filter(end_time__gt=timezone.now()):
+            names.add(challenge.image)
+        for host in placement.hosts():
+            client = docker_client.get_client(host)
+            where = host or "the default host"
+            for name in sorted(names):
+                if images.refresh_image(client, name, host=host):
+                    self.stdout.write(f"Pulled {name} on {where}")
+                else:
+                    self.stdout.write(f"{name} is up to date on {where}")
@@ -0,0 +1,64 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.conf import settings
+from challenges import models
+
+
+def run_job(job):
+    """Run a job in a worker thread"""
+    try:
+        job.run()
+    finally:
+        # Every thread gets its own database connection
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = "Runs queued process start and stop jobs"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=settings.JOB_WORKERS,
+            help="Number of jobs to run concurrently",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit when the queue is empty",
+        )
+
+    def handle(self, *args, workers, once, **kwargs):
+        # Jobs of workers that died are retried, others keep their jobs
+        requeued = models.ChallengeJob.requeue_abandoned()
+        if requeued:
+            self.stdout.write(f"Requeued {requeued} interrupted jobs")
+
+        running = {}
+        renewed = time.monotonic()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while True:
+                for job in models.ChallengeJob.claim(workers - len(running)):
+                    running[executor.submit(run_job, job)] = job
+                if time.monotonic() - renewed >= settings.JOB_LEASE / 3:
+                    models.ChallengeJob.renew_leases(running.values())
+                    requeued = models.ChallengeJob.requeue_abandoned()
+                    if requeued:
+                        self.stdout.write(f"Requeued {requeued} interrupted jobs")
+                    renewed = time.monotonic()
+                if running:
+                    done, _pending = wait(
+                        running,
+                        timeout=settings.JOB_POLL_INTERVAL,
+                        return_when=FIRST_COMPLETED,
+                    )
+                    for future in done:
+                        del running[future]
+                elif once:
+                    break
+                else:
+                    time.sleep(settings.JOB_POLL_INTERVAL)
@@ -0,0 +1,45 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from challenges import fingerprints, models
+
+
+class Command(BaseCommand):
+    help = "Reports students of a challenge who sent the same exploit payloads"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--challenge",
+            type=int,
+            action="append",
+            help="Only report matches for the challenge with this id",
+        )
+        parser.add_argument(
+            "--max-students",
+            type=int,
+            default=fingerprints.MAX_STUDENTS,
+            help="Ignore payloads sent by more students than this",
+        )
+
+    def handle(self, *args, challenge, max_students, **kwargs):
+        found, examples = fingerprints.scan()
+        if challenge:
+            found = {key: value for key, value in found.items() if key[0] in challenge}
+        matches = fingerprints.find_matches(found, examples, max_students)
+
+        challenges = models.Challenge.objects.in_bulk(
+            {match.challenge_id for match in matches}
+        )
+        users = get_user_model().objects.in_bulk(
+            {user for match in matches for user in match.users}
+        )
+        for match in matches:
+            students = " and ".join(
+                f"{users[user].student_number} ({users[user].username})"
+                for user in match.users
+            )
+            self.stdout.write(
+                f"{challenges[match.challenge_id].title}: {students} "
+                f"sent {len(match.payloads)} identical payloads"
+            )
+            for payload in match.payloads[:3]:
+                self.stdout.write(f"  {payload[:80]!r}")
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from challenges import models, similarity
+
+
+class Command(BaseCommand):
+    help = "Reports clusters of similar writeups per challenge"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--challenge",
+            type=int,
+            action="append",
+            help="Only compare writeups of the challenge with this id",
+        )
+        parser.add_argument(
+            "--threshold",
+            type=float,
+            default=similarity.THRESHOLD,
+            help="Estimated Jaccard similarity at which writeups are similar",
+        )
+
+    def handle(self, *args, challenge, threshold, **kwargs):
+        challenges = models.Challenge.objects.order_by("pk")
+        if challenge:
+            challenges = challenges.filter(pk__in=challenge)
+        entries = models.ChallengeEntry.objects.filter(challenge__in=challenges)
+        hashed = similarity.update_signatures(entries)
+        self.stdout.write(f"Hashed {hashed} new or changed writeups")
+
+        for challenge in challenges:
+            clusters = similarity.challenge_clusters(challenge, threshold)
+            if not clusters:
+                continue
+            self.stdout.write(f"{challenge.title}: {len(clusters)} clusters")
+            for entries, pairs in clusters:
+                score = max(score for _first, _second, score in pairs)
+                users = ", ".join(
+                    f"{entry.user.student_number} ({entry.user.username})"
+                    for entry in entries
+                )
+                self.stdout.write(f"  {score:.2f}: {users}")
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from challenges import models
+
+
+class Command(BaseCommand):
+    help = "Stops all running processes, for example at the end of an exam"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--challenge",
+            type=int,
+            action="append",
+            help="Only stop processes of the challenge with this id",
+        )
+
+    def handle(self, *args, challenge, **kwargs):
+        processes = models.ChallengeProcess.running_challenges.all()
+        if challenge:
+            processes = processes.filter(challenge_entry__challenge__in=challenge)
+        processes = list(processes)
+        models.ChallengeProcess.stop_many(processes)
+        self.stdout.write(f"Stopped {len(processes)} processes")
@@ -0,0 +1,46 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("challenges", "0013_auto_20210518_0929"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="challenge",
+            name="pool_size",
+            field=models.PositiveIntegerField(
+                default=0,
+                help_text="number of networks and proxies to prepare ahead of launches",
+                verbose_name="Warm pool size",
+            ),
+        ),
+        migrations.CreateModel(
+            name="PooledInstance",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("process_identifier", models.TextField()),
+                ("created", models.DateTimeField(auto_now_add=True)),
+                (
+                    "challenge",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="challenges.challenge",
+                    ),
+                ),
+            ],
+        ),
+    ]
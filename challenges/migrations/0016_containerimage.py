@@ -0,0 +1,30 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("challenges", "0015_challengejob"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ContainerImage",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("reference", models.CharField(max_length=255, unique=True)),
+                ("digest", models.CharField(max_length=255)),
+                ("checked", models.DateTimeField()),
+            ],
+        ),
+    ]
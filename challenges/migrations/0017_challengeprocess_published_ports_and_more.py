@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("challenges", "0016_containerimage"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="challengeprocess",
+            name="published_ports",
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name="pooledinstance",
+            name="proxy_ports",
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("challenges", "0017_challengeprocess_published_ports_and_more"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="NetworkPair",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("internal_id", models.CharField(max_length=64)),
+                ("internal_name", models.CharField(max_length=255)),
+                ("public_id", models.CharField(max_length=64)),
+                ("public_name", models.CharField(max_length=255)),
+                ("process_identifier", models.TextField(blank=True, db_index=True)),
+                ("leased", models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
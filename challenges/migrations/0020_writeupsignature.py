@@ -0,0 +1,39 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("challenges", "0019_networkpair"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="WriteupSignature",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("digest", models.CharField(max_length=64)),
+                ("signature", models.BinaryField()),
+                ("updated", models.DateTimeField(auto_now=True)),
+                (
+                    "entry",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="writeup_signature",
+                        to="challenges.challengeentry",
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,104 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:14
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("challenges", "0020_writeupsignature"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DockerHost",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=100, unique=True)),
+                ("endpoint", models.CharField(blank=True, max_length=255)),
+                ("hostname", models.CharField(max_length=255)),
+                ("capacity", models.PositiveIntegerField(default=50)),
+                ("enabled", models.BooleanField(default=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name="containerimage",
+            name="reference",
+            field=models.CharField(max_length=255),
+        ),
+        migrations.AddField(
+            model_name="challengejob",
+            name="host",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                to="challenges.dockerhost",
+            ),
+        ),
+        migrations.AddField(
+            model_name="challengeprocess",
+            name="host",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                to="challenges.dockerhost",
+            ),
+        ),
+        migrations.AddField(
+            model_name="containerimage",
+            name="host",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                to="challenges.dockerhost",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="containerimage",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("host__isnull", False)),
+                fields=("reference", "host"),
+                name="unique_image_per_host",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="containerimage",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("host__isnull", True)),
+                fields=("reference",),
+                name="unique_image_default_host",
+            ),
+        ),
+        migrations.AddField(
+            model_name="networkpair",
+            name="host",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                to="challenges.dockerhost",
+            ),
+        ),
+        migrations.AddField(
+            model_name="pooledinstance",
+            name="host",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                to="challenges.dockerhost",
+            ),
+        ),
+    ]
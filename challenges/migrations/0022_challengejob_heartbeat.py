@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("challenges", "0021_dockerhost"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="challengejob",
+            name="heartbeat",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
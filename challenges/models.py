@@ -3,8 +3,13 @@
 import logging
 import random
 import secrets
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 
 import docker
+import requests
 from django import forms
 from django.dispatch import receiver
 from django.db import models, transaction
@@ -17,6 +22,8 @@ from django.utils.translation import gettext_lazy as _
 from django.core import validators
 from django.urls import reverse
 
+from . import admission, docker_client, images, placement
+
 
 #: Logger instance
 logger = logging.getLogger(__name__)
@@ -76,6 +83,17 @@ class Challenge(models.Model):
         default=False,
     )
 
+    pool_size = models.PositiveIntegerField(
+        _("Warm pool size"),
+        help_text=_("number of networks and proxies to prepare ahead of launches"),
+        default=0,
+    )
+
+    @property
+    def image(self):
+        """The full name of the container image of this challenge"""
+        return f"{django_settings.CONTAINER_NAMESPACE}/{self.container}"
+
     @property
     def is_active(self):
         """Is this challenge currently active?"""
@@ -94,6 +112,67 @@ class Challenge(models.Model):
         return self.title
 
 
+class DockerHost(models.Model):
+    """A Docker daemon that processes can be placed on
+
+    Processes without a host run on the daemon from the environment, which
+    students reach at ``DOCKER_HOST``.
+    """
+
+    name = models.CharField(max_length=100, unique=True)
+
+    #: Docker endpoint like ``tcp://10.0.0.2:2375`` or ``ssh://docker@vm2``,
+    #: empty for the daemon configured in the environment
+    endpoint = models.CharField(max_length=255, blank=True)
+
+    #: The name students connect to for the published ports
+    hostname = models.CharField(max_length=255)
+
+    #: Running and pooled processes the host takes at most
+    capacity = models.PositiveIntegerField(default=50)
+
+    #: Disabled hosts get no new processes, but keep running the ones they have
+    enabled = models.BooleanField(default=True)
+
+    def __str__(self):
+        return self.name
+
+
+class ContainerImage(models.Model):
+    """The last known registry digest of an image we start containers from
+
+    There is a record per Docker host that has the image.
+    """
+
+    reference = models.CharField(max_length=255)
+
+    host = models.ForeignKey(
+        DockerHost, on_delete=models.CASCADE, null=True, blank=True
+    )
+
+    digest = models.CharField(max_length=255)
+
+    #: When the registry was last asked for the digest
+    checked = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["reference", "host"],
+                condition=Q(host__isnull=False),
+                name="unique_image_per_host",
+            ),
+            models.UniqueConstraint(
+                fields=["reference"],
+                condition=Q(host__isnull=True),
+                name="unique_image_default_host",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.reference}@{self.digest}"
+
+
 def random_settings():
     """Return randomized settings for the challenge
 
@@ -130,18 +209,135 @@ class ChallengeEntry(models.Model):
         return self.settings.get("flag", get_random_string(length=64))
 
     def submit_flag(self, flag):
+        """Check ``flag`` and complete the entry if it is correct
+
+        Only the first correct submission sets ``completion_time``.
+        """
         if flag is None or not flag.isascii():
             return False
-        if secrets.compare_digest(self.flag, flag):
-            self.completion_time = timezone.now()
-            self.save()
-            return True
-        return False
+        if not secrets.compare_digest(self.flag, flag):
+            return False
+        now = timezone.now()
+        completed = ChallengeEntry.objects.filter(
+            pk=self.pk, completion_time__isnull=True
+        ).update(completion_time=now)
+        if completed:
+            self.completion_time = now
+        return True
 
     def __str__(self):
         return f"{self.user} taking {self.challenge.title}"
 
 
+class WriteupSignature(models.Model):
+    """MinHash signature of the writeup of an entry
+
+    See :mod:`challenges.similarity`. ``digest`` covers the writeup and the
+    hashing parameters, so only changed writeups are hashed again.
+    """
+
+    entry = models.OneToOneField(
+        ChallengeEntry, on_delete=models.CASCADE, related_name="writeup_signature"
+    )
+
+    digest = models.CharField(max_length=64)
+
+    signature = models.BinaryField()
+
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Signature of {self.entry}"
+
+
+#: Prefix of the labels on the docker objects we create
+LABEL_PREFIX = "ctfexam"
+
+
+def docker_labels(**labels) -> dict:
+    """Labels identifying a docker object as part of this deployment
+
+    Pass ``process``, ``challenge``, ``user``, ``pair`` and ``role`` (one
+    of ``vuln``, ``proxy`` or ``network``) as far as they are known.
+    """
+    labels = {
+        f"{LABEL_PREFIX}.{key}": str(value)
+        for key, value in labels.items()
+        if value is not None
+    }
+    labels[f"{LABEL_PREFIX}.deployment"] = django_settings.DEPLOYMENT_NAME
+    return labels
+
+
+def _label_filters(labels) -> dict:
+    return {"label": [f"{key}={value}" for key, value in labels.items()]}
+
+
+def labelled_containers(client, **labels):
+    """All containers of this deployment matching ``labels``
+
+    Filtered by the daemon, so this is a single API call. The containers
+    are sparse: they only carry what the listing reports.
+    """
+    return client.containers.list(
+        all=True, sparse=True, filters=_label_filters(docker_labels(**labels))
+    )
+
+
+def named_containers(client, *dockerids):
+    """Containers of ``dockerids`` found by their names
+
+    Only for processes started before docker objects were labelled. The
+    daemon matches names as substrings, so this is a call per process.
+    """
+    containers = []
+    for dockerid in dockerids:
+        containers.extend(
+            container
+            for container in client.containers.list(
+                all=True, sparse=True, filters={"name": f"{dockerid}_"}
+            )
+            if any(
+                name.lstrip("/").startswith(f"{dockerid}_")
+                for name in container.attrs.get("Names", [])
+            )
+        )
+    return containers
+
+
+def named_networks(client, *dockerids):
+    """Networks of ``dockerids`` from before the network pool and the labels"""
+    names = [
+        f"{dockerid}_{kind}_network"
+        for dockerid in dockerids
+        for kind in ["internal", "public"]
+    ]
+    if not names:
+        return []
+    return [
+        network
+        for network in client.networks.list(names=names)
+        if network.name in names
+    ]
+
+
+def _remove_network(network):
+    try:
+        network.remove()
+    except docker.errors.NotFound:
+        pass
+
+
+#: Resources of every vulnerable container and logging proxy, which
+#: admission control adds up
+CPU_PERIOD = 100000
+VULN_CPU_QUOTA = 5000  # 5%
+VULN_MEMORY = 150 * 1024 * 1024
+VULN_PIDS = 100
+PROXY_CPU_QUOTA = 10000  # 10%
+PROXY_MEMORY = 100 * 1024 * 1024
+
+
 class ActiveChallengesManager(models.Manager):
     """Gets only active challenges"""
 
@@ -165,13 +361,61 @@ class ChallengeProcess(models.Model):
 
     started = models.DateTimeField(auto_now_add=True)
 
+    #: The Docker host running the containers, the default one if empty
+    host = models.ForeignKey(
+        DockerHost, on_delete=models.PROTECT, null=True, blank=True
+    )
+
+    #: Host ports of the listen ports, as recorded by :meth:`refresh_ports`
+    published_ports = models.JSONField(default=list, blank=True)
+
+    @property
+    def hostname(self):
+        """The name students connect to"""
+        if self.host is None:
+            return django_settings.DOCKER_HOST
+        return self.host.hostname
+
     @property
     def ports(self):
-        """Get the remotely accessible port"""
+        """Get the remotely accessible ports
+
+        These are recorded when the process starts, so showing them does
+        not need to talk to Docker.
+        """
         if not self.running:
             return []
-        client = docker.DockerClient.from_env()
+        if not self.published_ports:
+            self.refresh_ports()
+        return self.published_ports
+
+    @staticmethod
+    def _host_port(container, internal_port: str):
+        """The host port ``internal_port`` of ``container`` is published on"""
+        return (container.ports.get(internal_port) or [{"HostPort": None}])[0][
+            "HostPort"
+        ]
+
+    @staticmethod
+    def _format_ports(challenge: Challenge, proxy_ports, vuln_ports):
+        """Combine host ports of proxies and vulnerable container"""
         external_ports = []
+        for port_data in challenge.listen_ports:
+            port = str(port_data["port"])
+            if port_data["logged"]:
+                host_port = proxy_ports.get(port)
+            else:
+                host_port = vuln_ports.get(port)
+            external_ports.append(
+                {"port": host_port, "description": port_data["description"]}
+            )
+        return external_ports
+
+    def refresh_ports(self):
+        """Look up the published ports in Docker and record them"""
+        client = docker_client.get_client(self.host)
+        proxy_ports = {}
+        vuln_ports = {}
 
         try:
             listen_ports = self.challenge_entry.challenge.listen_ports
@@ -181,80 +425,225 @@ class ChallengeProcess(models.Model):
                     cont = client.containers.get(
                         f"{self.process_identifier}_proxy_{port}"
                     )
-                    internal_port = "4000/tcp"
+                    proxy_ports[str(port)] = self._host_port(cont, "4000/tcp")
                 else:
                     cont = client.containers.get(f"{self.process_identifier}_vuln")
-                    internal_port = f"{port}/tcp"
-                cont.reload()
-                external_ports.append(
-                    {
-                        "port": cont.ports.get(internal_port, [{"HostPort": None}])[0][
-                            "HostPort"
-                        ],
-                        "description": port_data["description"],
-                    }
-                )
+                    vuln_ports[str(port)] = self._host_port(cont, f"{port}/tcp")
         except docker.errors.NotFound:
-            self.stop()
-        return external_ports
+            # Pages call this, so the teardown is left to the job worker
+            with transaction.atomic():
+                # The conditional update makes sure the stop is queued once
+                if ChallengeProcess.objects.filter(pk=self.pk, running=True).update(
+                    running=False
+                ):
+                    ChallengeJob.enqueue_stop(
+                        self, challenge_entry=self.challenge_entry
+                    )
+            self.running = False
+            return
+        self.published_ports = self._format_ports(
+            self.challenge_entry.challenge, proxy_ports, vuln_ports
+        )
+        self.save(update_fields=["published_ports"])
+
+    refresh_ports.alters_data = True
+
+    def _reconcile_ports(self, challenge: Challenge, containers):
+        """Record the published ports again if the listing shows a change"""
+        dockerid = self.process_identifier
+        proxy_ports = {}
+        vuln_ports = {}
+        for port_data in challenge.listen_ports:
+            port = port_data["port"]
+            if port_data["logged"]:
+                container = containers.get(f"{dockerid}_proxy_{port}")
+                if container is not None:
+                    proxy_ports[str(port)] = self._listed_host_port(container, 4000)
+            else:
+                container = containers[f"{dockerid}_vuln"]
+                vuln_ports[str(port)] = self._listed_host_port(container, port)
+        ports = self._format_ports(challenge, proxy_ports, vuln_ports)
+        if ports != self.published_ports:
+            logger.info("Published ports of %s changed", dockerid)
+            self.published_ports = ports
+            self.save(update_fields=["published_ports"])
+
+    @staticmethod
+    def _listed_host_port(container, private_port: int):
+        """Host port of a container returned by ``containers.list``
+
+        Listed containers only carry the short port summary.
+        """
+        for port in container.attrs.get("Ports") or []:
+            if port.get("PrivatePort") == private_port and port.get("PublicPort"):
+                return str(port["PublicPort"])
+        return None
 
     @classmethod
     def cleanup(cls):
-        """Remove all stale process handles"""
-        client = docker.DockerClient.from_env()
-        for process in cls.running_challenges.all():
-            dockerid = process.process_identifier
-            try:
-                client.containers.get(f"{dockerid}_vuln")
-            except docker.errors.NotFound:
-                process.stop(client)
+        """Reconcile the running processes with what Docker is running
+
+        Lists all containers and networks of every host once, instead of
+        asking Docker about every process, and marks the lost processes in
+        one update.
+        """
+        processes = defaultdict(list)
+        running = cls.running_challenges.select_related("challenge_entry__challenge")
+        for process in running:
+            processes[process.host_id].append(process)
+        hosts = {host.pk: host for host in DockerHost.objects.all()}
+        if not hosts or None in processes:
+            hosts[None] = None
+
+        stale = []
+        for host_id, host in hosts.items():
+            stale.extend(cls._cleanup_host(host, processes[host_id]))
+        cls.objects.filter(pk__in=[process.pk for process in stale]).update(
+            running=False
+        )
 
     cleanup.alters_data = True
 
     @classmethod
-    def start(cls, challenge_entry: ChallengeEntry):
-        """Start the process"""
-        logger.info("Starting process for %s", challenge_entry.challenge.title)
-
-        challenge = challenge_entry.challenge
-        dockerid = (
+    def _cleanup_host(cls, host, processes):
+        """Clean up after the lost ``processes`` of ``host`` and return them"""
+        client = docker_client.get_client(host)
+        # Sparse listings only have the names the daemon reports
+        containers = {
+            name.lstrip("/"): container
+            for container in labelled_containers(client)
+            for name in container.attrs.get("Names", [])
+        }
+        # Processes from before the labels are only found by name
+        networks = {}
+        unlabelled = [
+            process.process_identifier
+            for process in processes
+            if f"{process.process_identifier}_vuln" not in containers
+        ]
+        if unlabelled:
+            for container in named_containers(client, *unlabelled):
+                for name in container.attrs.get("Names", []):
+                    containers[name.lstrip("/")] = container
+            for network in named_networks(client, *unlabelled):
+                networks[network.name] = network
+
+        stale = []
+        leftovers = []
+        for process in processes:
+            dockerid = process.process_identifier
+            challenge = process.challenge_entry.challenge
+            vuln = containers.get(f"{dockerid}_vuln")
+            if vuln is not None and vuln.status not in ("exited", "dead"):
+                process._reconcile_ports(challenge, containers)
+                continue
+
+            logger.info("Process %s is no longer running", dockerid)
+            stale.append(process)
+            leftovers.extend(
+                container
+                for name, container in containers.items()
+                if name.startswith(f"{dockerid}_")
+            )
+        stale_ids = [process.process_identifier for process in stale]
+
+        with ThreadPoolExecutor(
+            max_workers=django_settings.DOCKER_PARALLELISM
+        ) as executor:
+            cls._stop_containers(leftovers, executor)
+            NetworkPair.release(client, *stale_ids, executor=executor)
+            legacy_networks = [
+                networks[f"{dockerid}_{name}_network"]
+                for dockerid in stale_ids
+                for name in ["internal", "public"]
+                if f"{dockerid}_{name}_network" in networks
+            ]
+            list(executor.map(_remove_network, legacy_networks))
+        return stale
+
+    @staticmethod
+    def _make_identifier(challenge: Challenge, owner: str) -> str:
+        """Build the name prefix of all docker objects of a process"""
+        return (
             f"{slugify(challenge.title)}"
-            f"_{slugify(challenge_entry.user.username)}"
+            f"_{slugify(owner)}"
             f"_{timezone.now().strftime('%Y%m%d-%H%M%S')}"
             f"_{get_random_string(16)}"
         )
 
+    @staticmethod
+    def _pull_images(client, challenge: Challenge, host=None):
+        """Make sure the latest proxy and challenge images are available"""
+        images.ensure_image(client, django_settings.PROXY_CONTAINER, host=host)
+        images.ensure_image(client, challenge.image, host=host)
+
+    @staticmethod
+    def _create_environment(
+        client, challenge: Challenge, dockerid: str, executor, host=None
+    ):
+        """Create the networks and logging proxies of a process on ``host``
+
+        The proxies connect to ``vulnhost`` for every incoming connection,
+        so the vulnerable container can be started later on. They are
+        started concurrently through ``executor``.
+        Returns the internal network and the host ports of the proxies.
+        """
         logdir = django_settings.MEDIA_ROOT / "logs" / dockerid
         logdir.mkdir(parents=True)
 
-        client = docker.DockerClient.from_env()
-        client.images.pull(django_settings.PROXY_CONTAINER, tag="latest")
-        challenge_container = (
-            f"{django_settings.CONTAINER_NAMESPACE}/{challenge.container}"
-        )
-        client.images.pull(challenge_container, tag="latest")
-        internal = client.networks.create(
-            f"{dockerid}_internal_network",
-            internal=True,
-        )
-        client.networks.create(
-            f"{dockerid}_public_network",
-        )
+        labels = {"process": dockerid, "challenge": challenge.pk}
+        pair = NetworkPair.lease(client, dockerid, host)
+        internal = pair.internal(client)
+
+        def run_proxy(port):
+            proxy = client.containers.run(
+                django_settings.PROXY_CONTAINER,
+                name=f"{dockerid}_proxy_{port['port']}",
+                detach=True,
+                auto_remove=True,
+                cpu_period=CPU_PERIOD,
+                cpu_quota=PROXY_CPU_QUOTA,
+                mem_limit=PROXY_MEMORY,
+                network=pair.public_name,
+                stop_signal="SIGKILL",
+                security_opt=["no-new-privileges:true"],
+                cap_add=["CHOWN"],
+                environment={
+                    "VULNHOST": "vulnhost",
+                    "VULNPORT": f"{port['port']}",
+                },
+                ports={"4000": None},
+                volumes={
+                    str(logdir): {"bind": "/log/", "mode": "rw"},
+                },
+                labels=docker_labels(role="proxy", **labels),
+            )
+            internal.connect(proxy)
+            return str(port["port"]), ChallengeProcess._host_port(proxy, "4000/tcp")
+
+        logged_ports = [port for port in challenge.listen_ports if port["logged"]]
+        proxy_ports = dict(executor.map(run_proxy, logged_ports))
+        return internal, proxy_ports
+
+    @staticmethod
+    def _run_vuln(client, challenge_entry: ChallengeEntry, dockerid: str):
+        """Start the vulnerable container with the settings of the user"""
+        challenge = challenge_entry.challenge
         public_ports = {
             port["port"]: None for port in challenge.listen_ports if not port["logged"]
         }
-        vuln = client.containers.run(
-            challenge_container,
+        return client.containers.run(
+            challenge.image,
             name=f"{dockerid}_vuln",
             detach=True,
             auto_remove=False,
-            cpu_period=100000,
-            cpu_quota=5000,  # 5%
-            mem_limit="150m",
+            cpu_period=CPU_PERIOD,
+            cpu_quota=VULN_CPU_QUOTA,
+            mem_limit=VULN_MEMORY,
             network_mode=None,
             hostname="vulnhost",
             stop_signal="SIGKILL",
-            pids_limit=100,
+            pids_limit=VULN_PIDS,
             security_opt=["no-new-privileges:true"],
             privileged=challenge.privileged,
             ports=public_ports,
@@ -273,82 +662,614 @@ class ChallengeProcess(models.Model):
             environment={
                 key.upper(): value for key, value in challenge_entry.settings.items()
             },
+            labels=docker_labels(
+                role="vuln",
+                process=dockerid,
+                challenge=challenge.pk,
+                user=challenge_entry.user_id,
+            ),
         )
-        with transaction.atomic():
-            for port in challenge.listen_ports:
-                if not port["logged"]:
-                    continue
-                proxy = client.containers.run(
-                    django_settings.PROXY_CONTAINER,
-                    name=f"{dockerid}_proxy_{port['port']}",
-                    detach=True,
-                    auto_remove=True,
-                    cpu_period=100000,
-                    cpu_quota=10000,  # 10%
-                    mem_limit="100m",
-                    network=f"{dockerid}_public_network",
-                    stop_signal="SIGKILL",
-                    security_opt=["no-new-privileges:true"],
-                    cap_add=["CHOWN"],
-                    environment={
-                        "VULNHOST": "vulnhost",
-                        "VULNPORT": f"{port['port']}",
-                    },
-                    ports={"4000": None},
-                    volumes={
-                        str(logdir): {"bind": "/log/", "mode": "rw"},
-                    },
-                )
-                internal.connect(proxy)
 
+    @classmethod
+    def start(cls, challenge_entry: ChallengeEntry, host=None):
+        """Start the process
+
+        Runs on ``host`` if it is given, otherwise on the host chosen by
+        :func:`challenges.placement.place`. Uses a prepared environment from
+        the warm pool of that host if there is one.
+        """
+        logger.info("Starting process for %s", challenge_entry.challenge.title)
+
+        challenge = challenge_entry.challenge
+        if host is None:
+            host = placement.place(challenge)
+        client = docker_client.get_client(host)
+
+        pooled = PooledInstance.claim(challenge, host)
+        if pooled is not None:
+            dockerid = pooled.process_identifier
+        else:
+            dockerid = cls._make_identifier(challenge, challenge_entry.user.username)
+            cls._pull_images(client, challenge, host)
+
+        try:
+            with ThreadPoolExecutor(
+                max_workers=django_settings.DOCKER_PARALLELISM
+            ) as executor:
+                if pooled is not None:
+                    internal = NetworkPair.leased_by(dockerid).internal(client)
+                    proxy_ports = pooled.proxy_ports
+                    vuln = cls._run_vuln(client, challenge_entry, dockerid)
+                else:
+                    # The vulnerable container does not need the networks yet
+                    vuln_started = executor.submit(
+                        cls._run_vuln, client, challenge_entry, dockerid
+                    )
+                    internal, proxy_ports = cls._create_environment(
+                        client, challenge, dockerid, executor, host
+                    )
+                    vuln = vuln_started.result()
             internal.connect(vuln, aliases=["vulnhost"])
-            cls.objects.create(
+        except Exception:
+            # Do not leave containers and network leases behind
+            cls._teardown(client, [dockerid])
+            raise
+
+        vuln_ports = {
+            str(port["port"]): cls._host_port(vuln, f"{port['port']}/tcp")
+            for port in challenge.listen_ports
+            if not port["logged"]
+        }
+        # Only record the process once everything is up
+        with transaction.atomic():
+            return cls.objects.create(
                 challenge_entry=challenge_entry,
                 process_identifier=dockerid,
+                host=host,
                 running=True,
+                published_ports=cls._format_ports(challenge, proxy_ports, vuln_ports),
             )
 
     start.alters_data = True
 
+    @staticmethod
+    def _stop_containers(containers, executor):
+        """Stop ``containers`` concurrently"""
+
+        def stop_container(container):
+            try:
+                container.stop(timeout=2)
+            except docker.errors.NotFound:
+                logger.info("Container %s already removed", container.id)
+
+        # Consume the results to raise any other errors
+        list(executor.map(stop_container, containers))
+
+    @staticmethod
+    def _teardown(client, dockerids):
+        """Stop all containers and give back the networks of ``dockerids``
+
+        Containers are stopped concurrently, with at most
+        ``DOCKER_PARALLELISM`` calls in flight. The networks are only
+        touched once all containers are gone.
+        """
+        dockerids = set(dockerids)
+        if not dockerids:
+            return
+        started = time.monotonic()
+        if len(dockerids) == 1:
+            (dockerid,) = dockerids
+            containers = labelled_containers(client, process=dockerid)
+            unlabelled = set() if containers else dockerids
+        else:
+            # One listing of the whole deployment beats a call per process
+            process_label = f"{LABEL_PREFIX}.process"
+            containers = [
+                container
+                for container in labelled_containers(client)
+                if container.attrs.get("Labels", {}).get(process_label) in dockerids
+            ]
+            unlabelled = dockerids - {
+                container.attrs.get("Labels", {}).get(process_label)
+                for container in containers
+            }
+        # Pooled networks are given back with the pair, only processes from
+        # before the labels and the pool have networks of their own
+        networks = []
+        if unlabelled:
+            # Processes from before the labels are only found by name
+            containers = list(containers) + named_containers(client, *unlabelled)
+            networks = named_networks(client, *unlabelled)
+        listed = time.monotonic()
+
+        with ThreadPoolExecutor(
+            max_workers=django_settings.DOCKER_PARALLELISM
+        ) as executor:
+            ChallengeProcess._stop_containers(containers, executor)
+            stopped = time.monotonic()
+            NetworkPair.release(client, *dockerids, executor=executor)
+            # Processes from before the network pool have their own networks
+            list(executor.map(_remove_network, networks))
+        released = time.monotonic()
+
+        logger.info(
+            "Tore down %d processes: listing %.2fs, stopping %d containers %.2fs, "
+            "releasing networks %.2fs",
+            len(dockerids),
+            listed - started,
+            len(containers),
+            stopped - listed,
+            released - stopped,
+        )
+
+    @classmethod
+    def stop_many(cls, processes, client=None):
+        """Stop many processes with a bounded number of concurrent calls
+
+        Processes are torn down host by host, unless ``client`` is given.
+        """
+        processes = list(processes)
+        per_host = defaultdict(list)
+        for process in processes:
+            per_host[process.host_id].append(process)
+        for on_host in per_host.values():
+            host_client = client or docker_client.get_client(on_host[0].host)
+            cls._teardown(
+                host_client, [process.process_identifier for process in on_host]
+            )
+        cls.objects.filter(pk__in=[process.pk for process in processes]).update(
+            running=False
+        )
+        for process in processes:
+            process.running = False
+
+    stop_many.alters_data = True
+
     def stop(self, client=None):
         """Stop the process"""
         logger.info("Stopping process for %s", self.challenge_entry.challenge.title)
         if client is None:
-            client = docker.DockerClient.from_env()
-        dockerid = self.process_identifier
+            client = docker_client.get_client(self.host)
+        self._teardown(client, [self.process_identifier])
+
+        self.running = False
+        self.save()
+
+    stop.alters_data = True
+
+    def __str__(self):
+        return f"Process for {self.challenge_entry}"
+
+
+class PooledInstance(models.Model):
+    """Networks and proxies prepared ahead of time for a challenge
+
+    Claiming an instance only leaves starting the vulnerable container,
+    which needs the per-user settings of the entry.
+    """
+
+    challenge = models.ForeignKey(Challenge, on_delete=models.CASCADE)
+
+    process_identifier = models.TextField()
+
+    #: The Docker host the instance was prepared on, the default one if empty
+    host = models.ForeignKey(
+        DockerHost, on_delete=models.PROTECT, null=True, blank=True
+    )
+
+    #: Host ports of the proxies, by the challenge port they forward to
+    proxy_ports = models.JSONField(default=dict, blank=True)
+
+    created = models.DateTimeField(auto_now_add=True)
+
+    @classmethod
+    def claim(cls, challenge: Challenge, host=None):
+        """Take a prepared instance on ``host`` out of the pool, if there is one"""
+        candidates = cls.objects.filter(challenge=challenge, host=host).order_by(
+            "created"
+        )
+        for instance in candidates[:5]:
+            # Deleting is our lock: only one worker can remove the row
+            deleted, _rows = cls.objects.filter(pk=instance.pk).delete()
+            if deleted:
+                logger.info("Claimed pooled instance %s", instance.process_identifier)
+                return instance
+        return None
+
+    @classmethod
+    def fill(cls, challenge: Challenge, client=None) -> int:
+        """Prepare instances until the pool of ``challenge`` is full
+
+        Every instance goes to the host :func:`challenges.placement.place`
+        picks, so the pool is spread over the hosts. Stops early when all
+        hosts are full and returns the number of prepared instances.
+        """
+        missing = challenge.pool_size - cls.objects.filter(challenge=challenge).count()
+        created = 0
+        with ThreadPoolExecutor(
+            max_workers=django_settings.DOCKER_PARALLELISM
+        ) as executor:
+            for _i in range(missing):
+                try:
+                    host = placement.place(challenge, for_pool=True)
+                except placement.NoCapacity:
+                    logger.warning("No room left for the pool of %s", challenge)
+                    break
+                host_client = client or docker_client.get_client(host)
+                ChallengeProcess._pull_images(host_client, challenge, host)
+                dockerid = ChallengeProcess._make_identifier(challenge, "pool")
+                _internal, proxy_ports = ChallengeProcess._create_environment(
+                    host_client, challenge, dockerid, executor, host
+                )
+                cls.objects.create(
+                    challenge=challenge,
+                    process_identifier=dockerid,
+                    host=host,
+                    proxy_ports=proxy_ports,
+                )
+                created += 1
+        return created
+
+    fill.alters_data = True
+
+    @classmethod
+    def drain(cls, challenge: Challenge, keep: int = 0, client=None) -> int:
+        """Tear down pooled instances of ``challenge`` above ``keep``"""
+        surplus = (
+            cls.objects.filter(challenge=challenge)
+            .select_related("host")
+            .order_by("-created")[keep:]
+        )
+        drained = 0
+        for instance in surplus:
+            if cls.objects.filter(pk=instance.pk).delete()[0]:
+                instance.teardown(client or docker_client.get_client(instance.host))
+                drained += 1
+        return drained
+
+    drain.alters_data = True
+
+    def teardown(self, client):
+        """Remove the docker objects of this instance"""
+        ChallengeProcess._teardown(client, [self.process_identifier])
+
+    def __str__(self):
+        return f"Pooled instance for {self.challenge}"
+
+
+class NetworkPair(models.Model):
+    """An internal and a public network that processes take turns using
+
+    Creating networks is slow and every network takes one of the small
+    subnets from the daemon's address pools, so pairs are created ahead
+    of time and handed back to the pool when a process stops.
+    """
+
+    internal_id = models.CharField(max_length=64)
+
+    internal_name = models.CharField(max_length=255)
+
+    public_id = models.CharField(max_length=64)
+
+    public_name = models.CharField(max_length=255)
+
+    #: The process currently using the networks; empty while idle
+    process_identifier = models.TextField(blank=True, db_index=True)
+
+    #: The Docker host the networks exist on, the default one if empty
+    host = models.ForeignKey(
+        DockerHost, on_delete=models.PROTECT, null=True, blank=True
+    )
+
+    leased = models.DateTimeField(blank=True, null=True)
+
+    @classmethod
+    def create(cls, client, host=None):
+        """Create a new pair of networks on ``host``"""
+        suffix = get_random_string(16).lower()
+        name = f"{django_settings.DEPLOYMENT_NAME}_{suffix}"
+        labels = docker_labels(role="network", pair=suffix)
+        internal = client.networks.create(
+            f"{name}_internal_network", internal=True, labels=labels
+        )
+        public = client.networks.create(f"{name}_public_network", labels=labels)
+        return cls.objects.create(
+            internal_id=internal.id,
+            internal_name=internal.name,
+            public_id=public.id,
+            public_name=public.name,
+            host=host,
+        )
+
+    @classmethod
+    def fill(cls, client=None, host=None) -> int:
+        """Create pairs until ``NETWORK_POOL_SIZE`` of them are idle on ``host``"""
+        if client is None:
+            client = docker_client.get_client(host)
+        idle = cls.objects.filter(process_identifier="", host=host).count()
+        missing = max(django_settings.NETWORK_POOL_SIZE - idle, 0)
+        for _i in range(missing):
+            cls.create(client, host)
+        return missing
+
+    fill.alters_data = True
+
+    @classmethod
+    def lease(cls, client, dockerid: str, host=None):
+        """Hand out an idle pair on ``host`` to ``dockerid``, creating one if needed"""
+        for pair in cls.objects.filter(process_identifier="", host=host)[:5]:
+            # The conditional update makes sure nobody else leased it
+            if cls.objects.filter(pk=pair.pk, process_identifier="").update(
+                process_identifier=dockerid, leased=timezone.now()
+            ):
+                pair.process_identifier = dockerid
+                return pair
+        pair = cls.create(client, host)
+        pair.process_identifier = dockerid
+        pair.leased = timezone.now()
+        pair.save(update_fields=["process_identifier", "leased"])
+        return pair
+
+    lease.alters_data = True
+
+    @classmethod
+    def leased_by(cls, dockerid: str):
+        return cls.objects.get(process_identifier=dockerid)
+
+    @classmethod
+    def release(cls, client, *dockerids, executor=None):
+        """Disconnect everything from the pairs of ``dockerids``, return them
+
+        The processes must run on the host of ``client``. Above
+        ``NETWORK_POOL_MAX_IDLE`` idle pairs on that host, the networks are
+        removed. Docker calls go through ``executor`` if it is given.
+        """
+        run = executor.map if executor is not None else map
+        pairs = list(cls.objects.filter(process_identifier__in=dockerids))
+        disconnected = list(run(lambda pair: pair.disconnect_all(client), pairs))
+
+        returned = []
+        removed = []
+        idle = {}
+        for pair, intact in zip(pairs, disconnected):
+            if pair.host_id not in idle:
+                idle[pair.host_id] = cls.objects.filter(
+                    process_identifier="", host_id=pair.host_id
+                ).count()
+            if not intact:
+                logger.warning("Networks of %s disappeared", pair)
+                removed.append(pair)
+            elif idle[pair.host_id] >= django_settings.NETWORK_POOL_MAX_IDLE:
+                removed.append(pair)
+            else:
+                returned.append(pair.pk)
+                idle[pair.host_id] += 1
+        cls.objects.filter(pk__in=returned).update(process_identifier="", leased=None)
+        list(run(lambda pair: pair.remove_networks(client), removed))
+        cls.objects.filter(pk__in=[pair.pk for pair in removed]).delete()
+
+    release.alters_data = True
+
+    @classmethod
+    def reap(cls, client=None, grace=timedelta(minutes=10)):
+        """Release pairs leased to processes that no longer exist
+
+        Leases younger than ``grace`` belong to launches still in progress.
+        Pairs are released on their own host, unless ``client`` is given.
+        """
+        in_use = set(
+            ChallengeProcess.running_challenges.values_list(
+                "process_identifier", flat=True
+            )
+        ) | set(PooledInstance.objects.values_list("process_identifier", flat=True))
+        leaked = (
+            cls.objects.exclude(process_identifier="")
+            .exclude(process_identifier__in=in_use)
+            .filter(leased__lt=timezone.now() - grace)
+            .select_related("host")
+        )
+        hosts = {}
+        dockerids = defaultdict(set)
+        for pair in leaked:
+            hosts[pair.host_id] = pair.host
+            dockerids[pair.host_id].add(pair.process_identifier)
+        for host_id, leaked_by in dockerids.items():
+            logger.info("Reaping networks leaked by %s", ", ".join(sorted(leaked_by)))
+            cls.release(client or docker_client.get_client(hosts[host_id]), *leaked_by)
+
+    reap.alters_data = True
+
+    def internal(self, client):
+        """The internal network, without asking Docker about it"""
+        return client.networks.prepare_model(
+            {"Id": self.internal_id, "Name": self.internal_name}
+        )
 
-        def stop_container(name):
+    def disconnect_all(self, client) -> bool:
+        """Disconnect all (also stopped) containers from both networks
+
+        Returns whether both networks still exist.
+        """
+        for network_id in (self.internal_id, self.public_id):
             try:
-                container = client.containers.get(f"{dockerid}_{name}")
-                container.stop(timeout=2)
+                network = client.networks.get(network_id)
             except docker.errors.NotFound:
-                logger.exception("Container %s_%s already stopped", dockerid, name)
-
-        def remove_network(name):
+                return False
+            for container_id in network.attrs.get("Containers") or {}:
+                try:
+                    network.disconnect(container_id, force=True)
+                except docker.errors.NotFound:
+                    pass
+        return True
+
+    def remove_networks(self, client):
+        """Remove the networks from Docker"""
+        for network_id in (self.internal_id, self.public_id):
             try:
-                network = client.networks.get(f"{dockerid}_{name}_network")
-                network.remove()
+                client.networks.get(network_id).remove()
             except docker.errors.NotFound:
                 pass
 
-        stop_container("vuln")
-        for port in self.challenge_entry.challenge.listen_ports:
-            stop_container(f"proxy_{port['port']}")
-        for name in ["internal", "public"]:
-            remove_network(name)
+    def __str__(self):
+        return f"Networks {self.internal_name} and {self.public_name}"
+
 
-        self.running = False
+class ChallengeJob(models.Model):
+    """A start or stop request for the ``process_jobs`` worker
+
+    Docker calls can take a long time, so the web workers only queue jobs.
+    Stop jobs only need the process identifier to find the containers, as
+    the process row is usually deleted by the time they run.
+    """
+
+    START = "start"
+    STOP = "stop"
+    ACTION_CHOICES = [(START, _("start")), (STOP, _("stop"))]
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (QUEUED, _("queued")),
+        (RUNNING, _("running")),
+        (DONE, _("done")),
+        (FAILED, _("failed")),
+    ]
+
+    action = models.CharField(max_length=5, choices=ACTION_CHOICES)
+
+    status = models.CharField(max_length=7, choices=STATUS_CHOICES, default=QUEUED)
+
+    #: The entry this job was requested for, if it still exists
+    challenge_entry = models.ForeignKey(
+        ChallengeEntry, on_delete=models.CASCADE, null=True, blank=True
+    )
+
+    #: The process started by this job
+    process = models.ForeignKey(
+        ChallengeProcess, on_delete=models.SET_NULL, null=True, blank=True
+    )
+
+    #: Identifier of the process to stop
+    process_identifier = models.TextField(blank=True)
+
+    #: The Docker host of the process, once it is known
+    host = models.ForeignKey(
+        DockerHost, on_delete=models.SET_NULL, null=True, blank=True
+    )
+
+    #: Last sign of life from the worker running the job
+    heartbeat = models.DateTimeField(blank=True, null=True)
+
+    error = models.TextField(blank=True)
+
+    created = models.DateTimeField(auto_now_add=True)
+
+    finished = models.DateTimeField(blank=True, null=True)
+
+    @property
+    def is_pending(self):
+        return self.status in (self.QUEUED, self.RUNNING)
+
+    @classmethod
+    def enqueue_start(cls, challenge_entry: ChallengeEntry):
+        """Queue starting a process, unless a start is already pending"""
+        pending = cls.objects.filter(
+            action=cls.START,
+            challenge_entry=challenge_entry,
+            status__in=(cls.QUEUED, cls.RUNNING),
+        ).first()
+        if pending is not None:
+            return pending
+        return cls.objects.create(action=cls.START, challenge_entry=challenge_entry)
+
+    @classmethod
+    def enqueue_stop(cls, process: ChallengeProcess, challenge_entry=None):
+        """Queue tearing down the containers and networks of ``process``"""
+        return cls.objects.create(
+            action=cls.STOP,
+            challenge_entry=challenge_entry,
+            process_identifier=process.process_identifier,
+            host_id=process.host_id,
+        )
+
+    @classmethod
+    def claim(cls, limit: int):
+        """Mark up to ``limit`` queued jobs as running and return them
+
+        Stops come first, as they free resources. Starts are handed out by
+        :func:`challenges.admission.admit`.
+        """
+        claimed = []
+        stops = cls.objects.filter(status=cls.QUEUED, action=cls.STOP)
+        queued = list(stops.order_by("created")[:limit])
+        if len(queued) < limit:
+            queued += admission.admit(admission.queued_starts(), limit - len(queued))
+        for job in queued:
+            now = timezone.now()
+            # The conditional update makes sure only one worker gets the job
+            if cls.objects.filter(pk=job.pk, status=cls.QUEUED).update(
+                status=cls.RUNNING, heartbeat=now
+            ):
+                job.status = cls.RUNNING
+                job.heartbeat = now
+                claimed.append(job)
+        return claimed
+
+    @classmethod
+    def renew_leases(cls, jobs):
+        """Tell other workers that ``jobs`` are still being worked on"""
+        cls.objects.filter(pk__in=[job.pk for job in jobs], status=cls.RUNNING).update(
+            heartbeat=timezone.now()
+        )
+
+    @classmethod
+    def requeue_abandoned(cls) -> int:
+        """Queue running jobs again whose worker went quiet for ``JOB_LEASE``
+
+        Returns the number of jobs that were queued again.
+        """
+        expired = timezone.now() - timedelta(seconds=django_settings.JOB_LEASE)
+        return (
+            cls.objects.filter(status=cls.RUNNING)
+            .filter(Q(heartbeat__lt=expired) | Q(heartbeat__isnull=True))
+            .update(status=cls.QUEUED, heartbeat=None)
+        )
+
+    def run(self):
+        """Execute the job and record the outcome"""
+        try:
+            if self.action == self.START:
+                # Recorded first, so placements meanwhile count this start
+                self.host = placement.place(self.challenge_entry.challenge)
+                self.save(update_fields=["host"])
+                self.process = ChallengeProcess.start(self.challenge_entry, self.host)
+            else:
+                ChallengeProcess._teardown(
+                    docker_client.get_client(self.host), [self.process_identifier]
+                )
+            self.status = self.DONE
+        except Exception as exc:
+            logger.exception("Job %s failed", self)
+            if isinstance(exc, requests.exceptions.ConnectionError):
+                docker_client.reset_client(self.host)
+            self.status = self.FAILED
+            self.error = repr(exc)
+        self.finished = timezone.now()
         self.save()
 
-    stop.alters_data = True
+    run.alters_data = True
 
     def __str__(self):
-        return f"Process for {self.challenge_entry}"
+        target = self.challenge_entry or self.process_identifier
+        return f"{self.get_action_display()} {target}"
 
 
 @receiver(
     models.signals.pre_delete, sender=ChallengeProcess, dispatch_uid="terminate_process"
 )
 def terminate_process_on_delete(sender, instance, **_kwargs):
-    """Make sure the process is stopped before we lose track"""
-    instance.stop()
+    """Make sure the process is stopped after we lose track"""
+    if instance.running:
+        ChallengeJob.enqueue_stop(instance)
@@ -0,0 +1,101 @@
+"""Placing processes on Docker hosts
+
+Processes go to the enabled :class:`~challenges.models.DockerHost` with the
+lowest load, relative to its capacity. The load of a host counts its running
+processes, pooled instances and starts in progress. Hosts that already have
+the image of the challenge are preferred, as long as they are at most
+:data:`IMAGE_AFFINITY` of their capacity busier than the least loaded host;
+hosts with a pooled instance of the challenge come first, since claiming it
+adds no load. Filling the warm pool ignores that preference, so the pool
+is spread over the hosts.
+
+While no hosts are registered everything runs on the daemon from the
+environment, which is represented by ``None``.
+"""
+
+from collections import Counter
+
+from django.db.models import Count
+
+from . import images, models
+
+#: Fraction of its capacity a host with the image may be busier and still win
+IMAGE_AFFINITY = 0.1
+
+
+class NoCapacity(Exception):
+    """All Docker hosts are full"""
+
+
+def hosts():
+    """Enabled hosts, or only the default daemon if none are registered"""
+    registered = list(models.DockerHost.objects.all())
+    if not registered:
+        return [None]
+    return [host for host in registered if host.enabled]
+
+
+def load() -> Counter:
+    """Running processes, pooled instances and starts in progress per host id"""
+    counts = Counter()
+    for queryset in (
+        models.ChallengeProcess.running_challenges.all(),
+        models.PooledInstance.objects.all(),
+        models.ChallengeJob.objects.filter(
+            action=models.ChallengeJob.START, status=models.ChallengeJob.RUNNING
+        ),
+    ):
+        counts.update(dict(queryset.values_list("host").annotate(n=Count("pk"))))
+    return counts
+
+
+def free_slots():
+    """Processes that fit on the enabled hosts, ``None`` without hosts"""
+    available = [host for host in hosts() if host is not None]
+    if not available:
+        return None
+    current = load()
+    return sum(max(host.capacity - current[host.pk], 0) for host in available)
+
+
+def rank(challenge, for_pool=False):
+    """Enabled hosts that can take a process of ``challenge``, best first
+
+    With ``for_pool``, the host is wanted for a new pooled instance, which
+    adds load wherever it goes.
+    """
+    current = load()
+    pooled = set()
+    if not for_pool:
+        pooled = set(
+            models.PooledInstance.objects.filter(challenge=challenge).values_list(
+                "host", flat=True
+            )
+        )
+    cached = images.hosts_with_image(challenge.image)
+
+    def score(host):
+        busy = current[host.pk] / host.capacity
+        if host.pk in cached:
+            busy -= IMAGE_AFFINITY
+        return (host.pk not in pooled, busy, host.name)
+
+    candidates = [
+        host
+        for host in models.DockerHost.objects.filter(enabled=True, capacity__gt=0)
+        if host.pk in pooled or current[host.pk] < host.capacity
+    ]
+    return sorted(candidates, key=score)
+
+
+def place(challenge, for_pool=False):
+    """The host to start a process of ``challenge`` on
+
+    ``for_pool`` is passed on to :func:`rank`. Raises :class:`NoCapacity` if all hosts are full.
+    """
+    if not models.DockerHost.objects.exists():
+        return None
+    ranked = rank(challenge, for_pool)
+    if not ranked:
+        raise NoCapacity(f"No Docker host has room for {challenge}")
+    return ranked[0]
@@ -0,0 +1,39 @@
+"""Token buckets in the cache
+
+Each bucket holds up to ``burst`` tokens and refills at ``rate`` tokens per
+second. A bucket is stored as its theoretical arrival time: the moment, in
+milliseconds, at which it would be full again. Taking a token pushes that
+time back by one refill interval with an atomic ``incr``, so concurrent
+requests, also in other workers sharing the cache, never spend the same
+token.
+"""
+
+import time
+
+from django.core.cache import cache
+
+
+def take(key, rate, burst):
+    """Take a token from the bucket ``key``
+
+    Returns ``0`` if a token was available, otherwise the number of seconds
+    until the next one is.
+    """
+    # Wall clock time, as workers share the bucket
+    now = int(time.time() * 1000)
+    interval = max(int(1000 / rate), 1)
+    bucket = f"bucket:{key}"
+    cache.add(bucket, now, timeout=int(burst / rate) + 1)
+    try:
+        arrival = cache.incr(bucket, interval)
+    except ValueError:
+        # Expired right after the add, so the bucket was full
+        cache.add(bucket, now + interval, timeout=int(burst / rate) + 1)
+        arrival = now + interval
+    wait = arrival - now - burst * interval
+    if wait > 0:
+        cache.decr(bucket, interval)
+        return wait / 1000
+    # Once full again the bucket is the same as a missing one
+    cache.touch(bucket, timeout=max(arrival - now, 0) // 1000 + 1)
+    return 0
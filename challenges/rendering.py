@@ -0,0 +1,43 @@
+"""Rendering of challenge descriptions and writeups
+
+Markdown with ``codehilite`` runs Pygments, which is too slow to do on
+every page view. Rendered HTML is cached by a hash of the source text, so
+an edit simply produces a new cache key; the old entry is evicted once it
+is the least recently used one.
+"""
+
+import hashlib
+import threading
+
+import markdown
+from django.conf import settings
+from django.core.cache import caches
+
+_local = threading.local()
+
+
+def _markdown() -> markdown.Markdown:
+    """The ``Markdown`` instance of this thread
+
+    Setting up the extensions is expensive, but instances are not thread
+    safe, so each thread keeps its own.
+    """
+    md = getattr(_local, "markdown", None)
+    if md is None:
+        md = _local.markdown = markdown.Markdown(
+            extensions=["extra", "smarty", "codehilite"],
+        )
+    return md
+
+
+def markdownize(text):
+    """Render ``text`` as markdown, if it is not None"""
+    if text is None:
+        return ""
+    cache = caches[settings.MARKDOWN_CACHE]
+    key = f"markdown:{hashlib.sha256(text.encode()).hexdigest()}"
+    html = cache.get(key)
+    if html is None:
+        html = _markdown().reset().convert(text)
+        cache.set(key, html)
+    return html
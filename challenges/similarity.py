@@ -0,0 +1,245 @@
+"""Finding similar writeups with MinHash and locality-sensitive hashing
+
+Every writeup is split into shingles of :data:`SHINGLE_SIZE` words. The
+MinHash signature of these shingles estimates the Jaccard similarity of two
+writeups by the fraction of positions where their signatures agree.
+Instead of comparing all pairs, signatures are cut into :data:`BANDS` bands
+and only writeups that agree on a whole band become candidates, which are
+then checked against the threshold.
+
+Signatures are stored in :class:`~challenges.models.WriteupSignature`.
+NumPy hashes writeups in batches if it is installed; otherwise a slower
+pure Python implementation computes the same signatures.
+
+Benchmarks import this module without setting up Django, so models are
+only imported inside functions.
+"""
+
+import hashlib
+import random
+import re
+import struct
+import zlib
+from collections import defaultdict
+from itertools import chain, combinations
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+#: Words per shingle
+SHINGLE_SIZE = 3
+
+#: Number of hash functions in a signature
+NUM_PERM = 128
+
+#: Bands for locality-sensitive hashing, must divide :data:`NUM_PERM`
+BANDS = 32
+
+#: Default estimated Jaccard similarity at which writeups count as similar
+THRESHOLD = 0.5
+
+#: Shingles hashed at once by NumPy, bounds memory to NUM_PERM * 8 bytes each
+BATCH_SHINGLES = 1 << 15
+
+#: Mersenne prime for the hash functions ``(a * x + b) % PRIME``
+PRIME = (1 << 31) - 1
+
+_rng = random.Random(0x5EED)
+_PARAMS = [(_rng.randrange(1, PRIME), _rng.randrange(PRIME)) for _i in range(NUM_PERM)]
+
+_WORD = re.compile(r"\w+")
+
+
+def shingles(text) -> set:
+    """Hashes of the word shingles of ``text``"""
+    words = _WORD.findall(text.lower())
+    if len(words) <= SHINGLE_SIZE:
+        return {zlib.crc32(" ".join(words).encode()) % PRIME} if words else set()
+    return {
+        zlib.crc32(" ".join(words[i : i + SHINGLE_SIZE]).encode()) % PRIME
+        for i in range(len(words) - SHINGLE_SIZE + 1)
+    }
+
+
+def digest(text) -> str:
+    """Changes whenever the signature of ``text`` would"""
+    params = f"{SHINGLE_SIZE}:{NUM_PERM}:{PRIME}:"
+    return hashlib.sha256((params + text).encode()).hexdigest()
+
+
+def _signature_python(values) -> bytes:
+    return struct.pack(
+        f"<{NUM_PERM}I", *(min((a * x + b) % PRIME for x in values) for a, b in _PARAMS)
+    )
+
+
+def _signatures_numpy(batch):
+    lengths = numpy.fromiter(map(len, batch), dtype=numpy.int64, count=len(batch))
+    values = numpy.fromiter(
+        chain.from_iterable(batch), dtype=numpy.uint64, count=int(lengths.sum())
+    )
+    a = numpy.array([a for a, _b in _PARAMS], dtype=numpy.uint64)[:, None]
+    b = numpy.array([b for _a, b in _PARAMS], dtype=numpy.uint64)[:, None]
+    hashed = (a * values[None, :] + b) % PRIME
+    offsets = numpy.concatenate(([0], numpy.cumsum(lengths)[:-1]))
+    minima = numpy.minimum.reduceat(hashed, offsets, axis=1)
+    return [column.astype("<u4").tobytes() for column in minima.T]
+
+
+def signatures(shingle_sets):
+    """MinHash signatures of non-empty shingle sets, as bytes"""
+    if numpy is None:
+        return [_signature_python(values) for values in shingle_sets]
+    result = []
+    batch = []
+    size = 0
+    for values in shingle_sets:
+        batch.append(values)
+        size += len(values)
+        if size >= BATCH_SHINGLES:
+            result.extend(_signatures_numpy(batch))
+            batch = []
+            size = 0
+    if batch:
+        result.extend(_signatures_numpy(batch))
+    return result
+
+
+def similarity(first: bytes, second: bytes) -> float:
+    """Estimated Jaccard similarity of two signatures"""
+    if numpy is not None:
+        return float(
+            numpy.mean(
+                numpy.frombuffer(first, dtype="<u4")
+                == numpy.frombuffer(second, dtype="<u4")
+            )
+        )
+    same = sum(
+        x == y
+        for x, y in zip(
+            struct.unpack(f"<{NUM_PERM}I", first),
+            struct.unpack(f"<{NUM_PERM}I", second),
+        )
+    )
+    return same / NUM_PERM
+
+
+def similar_pairs(signatures, threshold=THRESHOLD):
+    """``(key, key, similarity)`` of similar items in ``{key: signature}``"""
+    band_size = len(next(iter(signatures.values()), b"")) // BANDS
+    buckets = defaultdict(list)
+    for key, signature in signatures.items():
+        for band in range(BANDS):
+            start = band * band_size
+            buckets[band, signature[start : start + band_size]].append(key)
+
+    candidates = set()
+    for keys in buckets.values():
+        candidates.update(combinations(sorted(keys), 2))
+    pairs = []
+    for first, second in sorted(candidates):
+        score = similarity(signatures[first], signatures[second])
+        if score >= threshold:
+            pairs.append((first, second, score))
+    return pairs
+
+
+def clusters(pairs):
+    """Group the keys of ``pairs`` into connected clusters"""
+    parent = {}
+
+    def find(key):
+        parent.setdefault(key, key)
+        while parent[key] != key:
+            parent[key] = parent[parent[key]]
+            key = parent[key]
+        return key
+
+    for first, second, _score in pairs:
+        parent[find(first)] = find(second)
+    groups = defaultdict(set)
+    for key in list(parent):
+        groups[find(key)].add(key)
+    return sorted((sorted(group) for group in groups.values()), key=lambda g: g[0])
+
+
+def update_signatures(entries, chunk_size=1000) -> int:
+    """Store signatures of ``entries`` whose writeup is new or changed
+
+    Returns the number of writeups that were hashed.
+    """
+    from django.db.models import Q
+
+    from .models import WriteupSignature
+
+    WriteupSignature.objects.filter(entry__in=entries).filter(
+        Q(entry__writeup="") | Q(entry__writeup=None)
+    ).delete()
+    known = dict(
+        WriteupSignature.objects.filter(entry__in=entries).values_list(
+            "entry_id", "digest"
+        )
+    )
+    rows = (
+        entries.exclude(writeup="").exclude(writeup=None).values_list("pk", "writeup")
+    )
+    stale = []
+    hashed = 0
+    for pk, writeup in rows.iterator(chunk_size=chunk_size):
+        text_digest = digest(writeup)
+        if known.get(pk) == text_digest or not (values := shingles(writeup)):
+            continue
+        stale.append((pk, text_digest, values))
+        if len(stale) >= chunk_size:
+            hashed += _store(stale)
+            stale = []
+    if stale:
+        hashed += _store(stale)
+    return hashed
+
+
+def _store(stale):
+    from .models import WriteupSignature
+
+    computed = signatures([values for _pk, _digest, values in stale])
+    WriteupSignature.objects.bulk_create(
+        [
+            WriteupSignature(entry_id=pk, digest=text_digest, signature=signature)
+            for (pk, text_digest, _values), signature in zip(stale, computed)
+        ],
+        update_conflicts=True,
+        unique_fields=["entry"],
+        update_fields=["digest", "signature", "updated"],
+    )
+    return len(stale)
+
+
+def challenge_clusters(challenge, threshold=THRESHOLD):
+    """Clusters of similar writeups of ``challenge``
+
+    Returns ``(entries, pairs)`` for every cluster, where ``pairs`` are the
+    similar pairs of entry primary keys in it.
+    """
+    from .models import ChallengeEntry, WriteupSignature
+
+    stored = WriteupSignature.objects.filter(entry__challenge=challenge)
+    pairs = similar_pairs(
+        {
+            pk: bytes(signature)
+            for pk, signature in stored.values_list("entry", "signature")
+        },
+        threshold,
+    )
+    groups = clusters(pairs)
+    entries = ChallengeEntry.objects.select_related("user").in_bulk(
+        list(chain.from_iterable(groups))
+    )
+    return [
+        (
+            [entries[pk] for pk in group],
+            [pair for pair in pairs if pair[0] in group],
+        )
+        for group in groups
+    ]
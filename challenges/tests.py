@@ -1,3 +1,1380 @@
-from django.test import TestCase
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import io
+import os
+import sqlite3
+import tarfile
+import time
+from pathlib import Path, PurePosixPath
+from tempfile import TemporaryDirectory
+from unittest import mock, skipIf
+import zipfile
 
-# Create your tests here.
+import docker
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.template import loader
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import (
+    admission,
+    collect,
+    docker_client,
+    fingerprints,
+    images,
+    logs,
+    models,
+    placement,
+    ratelimit,
+    rendering,
+    similarity,
+    transcripts,
+)
+
+
+class PooledInstanceTests(TestCase):
+    def setUp(self):
+        self.challenge = models.Challenge.objects.create(
+            title="Stack smash",
+            description="",
+            solution="",
+            container="stack",
+            end_time=timezone.now() + timedelta(days=1),
+            pool_size=2,
+        )
+
+    def test_claim_oldest_first(self):
+        first = models.PooledInstance.objects.create(
+            challenge=self.challenge, process_identifier="first"
+        )
+        models.PooledInstance.objects.create(
+            challenge=self.challenge, process_identifier="second"
+        )
+        claimed = models.PooledInstance.claim(self.challenge)
+        self.assertEqual(claimed.pk, first.pk)
+        self.assertEqual(models.PooledInstance.objects.count(), 1)
+
+    def test_claim_empty_pool(self):
+        self.assertIsNone(models.PooledInstance.claim(self.challenge))
+
+
+class ChallengeJobTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            username="student", password="foo", student_number="s1234567"
+        )
+        self.challenge = models.Challenge.objects.create(
+            title="Stack smash",
+            description="",
+            solution="",
+            container="stack",
+            end_time=timezone.now() + timedelta(days=1),
+        )
+        self.entry = models.ChallengeEntry.objects.create(
+            challenge=self.challenge, user=self.user
+        )
+        self.client.force_login(self.user)
+
+    def test_start_is_queued_once(self):
+        url = reverse("challenges:create_process", kwargs={"pk": self.challenge.pk})
+        first = self.client.post(url).json()
+        second = self.client.post(url).json()
+        self.assertEqual(first["job"], second["job"])
+        self.assertEqual(first["status"], models.ChallengeJob.QUEUED)
+        status = self.client.get(first["status_url"]).json()
+        self.assertEqual(status["job"], first["job"])
+
+    def test_delete_queues_stop(self):
+        process = models.ChallengeProcess.objects.create(
+            challenge_entry=self.entry, process_identifier="proc", running=True
+        )
+        response = self.client.post(
+            reverse("challenges:delete-process", kwargs={"pk": process.pk})
+        )
+        job = models.ChallengeJob.objects.get(pk=response.json()["job"])
+        self.assertEqual(job.action, models.ChallengeJob.STOP)
+        self.assertEqual(job.process_identifier, "proc")
+        self.assertFalse(models.ChallengeProcess.objects.exists())
+        self.assertEqual(models.ChallengeJob.objects.count(), 1)
+
+    @mock.patch("challenges.docker_client.get_client")
+    def test_recorded_ports_skip_docker(self, get_client):
+        ports = [{"port": "32768", "description": "challenge port"}]
+        process = models.ChallengeProcess.objects.create(
+            challenge_entry=self.entry,
+            process_identifier="proc",
+            running=True,
+            published_ports=ports,
+        )
+        response = self.client.get(
+            reverse("challenges:challenge", kwargs={"pk": self.challenge.pk})
+        )
+        self.assertContains(response, "32768")
+        get_client.assert_not_called()
+
+    @mock.patch("challenges.docker_client.get_client")
+    def test_missing_ports_queue_stop(self, get_client):
+        self.challenge.listen_ports = [
+            {"port": 1337, "description": "logged", "logged": True}
+        ]
+        self.challenge.save()
+        process = models.ChallengeProcess.objects.create(
+            challenge_entry=self.entry, process_identifier="proc", running=True
+        )
+        get_client.return_value.containers.get.side_effect = docker.errors.NotFound(
+            "gone"
+        )
+        self.assertEqual(process.ports, [])
+        models.ChallengeProcess.objects.get().refresh_ports()
+
+        job = models.ChallengeJob.objects.get()
+        self.assertEqual(job.action, models.ChallengeJob.STOP)
+        self.assertEqual(job.process_identifier, "proc")
+        self.assertFalse(models.ChallengeProcess.objects.get().running)
+        get_client.return_value.containers.list.assert_not_called()
+
+    def test_requeues_only_abandoned(self):
+        stop = models.ChallengeJob.enqueue_stop(
+            models.ChallengeProcess(process_identifier="proc")
+        )
+        (claimed,) = models.ChallengeJob.claim(1)
+        self.assertIsNotNone(claimed.heartbeat)
+        abandoned = models.ChallengeJob.objects.create(
+            action=models.ChallengeJob.START,
+            challenge_entry=self.entry,
+            status=models.ChallengeJob.RUNNING,
+            heartbeat=timezone.now() - timedelta(minutes=5),
+        )
+
+        self.assertEqual(models.ChallengeJob.requeue_abandoned(), 1)
+        stop.refresh_from_db()
+        abandoned.refresh_from_db()
+        self.assertEqual(stop.status, models.ChallengeJob.RUNNING)
+        self.assertEqual(abandoned.status, models.ChallengeJob.QUEUED)
+
+        models.ChallengeJob.objects.filter(pk=stop.pk).update(
+            heartbeat=timezone.now() - timedelta(minutes=5)
+        )
+        models.ChallengeJob.renew_leases([stop])
+        self.assertEqual(models.ChallengeJob.requeue_abandoned(), 0)
+
+    @mock.patch("challenges.docker_client.get_client")
+    def test_cleanup_marks_lost_processes(self, get_client):
+        def container(name, status="running", ports=()):
+            return mock.Mock(
+                status=status, attrs={"Names": [f"/{name}"], "Ports": list(ports)}
+            )
+
+        alive = models.ChallengeProcess.objects.create(
+            challenge_entry=self.entry, process_identifier="alive", running=True
+        )
+        lost = models.ChallengeProcess.objects.create(
+            challenge_entry=self.entry, process_identifier="lost", running=True
+        )
+        leftover_proxy = container("lost_proxy_1337")
+        get_client.return_value.containers.list.return_value = [
+            container("alive_vuln"),
+            container(
+                "alive_proxy_1337",
+                ports=[{"PrivatePort": 4000, "PublicPort": 32768, "Type": "tcp"}],
+            ),
+            leftover_proxy,
+        ]
+        get_client.return_value.networks.list.return_value = []
+
+        models.ChallengeProcess.cleanup()
+
+        # The lost process is also looked up by name, in case it is unlabelled
+        labelled = [
+            call
+            for call in get_client.return_value.containers.list.call_args_list
+            if "label" in call.kwargs["filters"]
+        ]
+        self.assertEqual(len(labelled), 1)
+        leftover_proxy.stop.assert_called_once()
+        lost.refresh_from_db()
+        alive.refresh_from_db()
+        self.assertFalse(lost.running)
+        self.assertTrue(alive.running)
+        self.assertEqual(alive.published_ports[0]["port"], "32768")
+
+    @mock.patch("challenges.docker_client.get_client")
+    def test_unlabelled_process_found_by_name(self, get_client):
+        process = models.ChallengeProcess.objects.create(
+            challenge_entry=self.entry, process_identifier="legacy", running=True
+        )
+        vuln = mock.Mock(status="running", attrs={"Names": ["/legacy_vuln"]})
+        other = mock.Mock(status="running", attrs={"Names": ["/legacy2_vuln"]})
+        network = mock.Mock()
+        network.name = "legacy_internal_network"
+
+        def list_containers(all, sparse, filters):
+            return [] if "label" in filters else [vuln, other]
+
+        def list_networks(filters=None, names=None):
+            return [] if filters else [network]
+
+        get_client.return_value.containers.list.side_effect = list_containers
+        get_client.return_value.networks.list.side_effect = list_networks
+
+        models.ChallengeProcess.cleanup()
+        process.refresh_from_db()
+        self.assertTrue(process.running)
+
+        process.stop()
+        vuln.stop.assert_called_once()
+        other.stop.assert_not_called()
+        network.remove.assert_called_once()
+
+    @mock.patch("challenges.docker_client.get_client")
+    def test_stop_job_uses_labels(self, get_client):
+        proxy = mock.Mock()
+        get_client.return_value.containers.list.return_value = [proxy]
+        job = models.ChallengeJob.objects.create(
+            action=models.ChallengeJob.STOP, process_identifier="proc"
+        )
+        job.run()
+        self.assertEqual(job.status, models.ChallengeJob.DONE)
+        proxy.stop.assert_called_once()
+        filters = get_client.return_value.containers.list.call_args.kwargs["filters"]
+        self.assertIn("ctfexam.process=proc", filters["label"])
+        # The network pair is released, there are no networks to look up
+        get_client.return_value.networks.list.assert_not_called()
+
+    @mock.patch("challenges.docker_client.get_client")
+    def test_stop_many_lists_once(self, get_client):
+        def container(process):
+            return mock.Mock(attrs={"Labels": {"ctfexam.process": process}})
+
+        processes = [
+            models.ChallengeProcess.objects.create(
+                challenge_entry=self.entry, process_identifier=name, running=True
+            )
+            for name in ["one", "two"]
+        ]
+        containers = [container("one"), container("two"), container("other")]
+        get_client.return_value.containers.list.return_value = containers
+        get_client.return_value.networks.list.return_value = []
+
+        models.ChallengeProcess.stop_many(processes)
+
+        self.assertEqual(get_client.return_value.containers.list.call_count, 1)
+        containers[0].stop.assert_called_once()
+        containers[1].stop.assert_called_once()
+        containers[2].stop.assert_not_called()
+        self.assertFalse(models.ChallengeProcess.running_challenges.exists())
+
+    @mock.patch("challenges.images.ensure_image")
+    @mock.patch("challenges.docker_client.get_client")
+    def test_start_records_process(self, get_client, _ensure_image):
+        self.challenge.listen_ports = [
+            {"port": 1337, "description": "logged", "logged": True},
+            {"port": 1338, "description": "logged too", "logged": True},
+            {"port": 8080, "description": "direct", "logged": False},
+        ]
+        self.challenge.save()
+
+        pair = models.NetworkPair.objects.create(
+            internal_id="int", internal_name="int", public_id="pub", public_name="pub"
+        )
+
+        def run(image, name, ports, **kwargs):
+            host_ports = {"proxy_1337": "1", "proxy_1338": "2", "vuln": "3"}
+            host_port = host_ports[name.split("_", 4)[-1]]
+            (internal_port,) = ports
+            return mock.Mock(ports={f"{internal_port}/tcp": [{"HostPort": host_port}]})
+
+        get_client.return_value.containers.run.side_effect = run
+        with TemporaryDirectory() as media, override_settings(MEDIA_ROOT=Path(media)):
+            process = models.ChallengeProcess.start(self.entry)
+
+        self.assertTrue(process.running)
+        self.assertEqual(get_client.return_value.containers.run.call_count, 3)
+        self.assertEqual(
+            [port["port"] for port in process.published_ports], ["1", "2", "3"]
+        )
+        self.assertEqual(
+            models.NetworkPair.leased_by(process.process_identifier).pk, pair.pk
+        )
+
+    @mock.patch("challenges.images.ensure_image")
+    @mock.patch("challenges.docker_client.get_client")
+    def test_failed_start_tears_down(self, get_client, _ensure_image):
+        models.NetworkPair.objects.create(
+            internal_id="int", internal_name="int", public_id="pub", public_name="pub"
+        )
+        get_client.return_value.containers.run.side_effect = ConnectionError
+        get_client.return_value.containers.list.return_value = []
+        get_client.return_value.networks.list.return_value = []
+        with TemporaryDirectory() as media, override_settings(MEDIA_ROOT=Path(media)):
+            with self.assertRaises(ConnectionError):
+                models.ChallengeProcess.start(self.entry)
+
+        self.assertFalse(models.ChallengeProcess.objects.exists())
+        self.assertFalse(
+            models.NetworkPair.objects.exclude(process_identifier="").exists()
+        )
+
+    def test_cascade_queues_stop(self):
+        models.ChallengeProcess.objects.create(
+            challenge_entry=self.entry, process_identifier="proc", running=True
+        )
+        self.entry.delete()
+        job = models.ChallengeJob.objects.get()
+        self.assertEqual(job.process_identifier, "proc")
+        self.assertIsNone(job.challenge_entry)
+
+
+class ImageCacheTests(TestCase):
+    def test_fresh_image_skips_docker(self):
+        models.ContainerImage.objects.create(
+            reference="proxy:latest", digest="sha256:abc", checked=timezone.now()
+        )
+        client = mock.Mock()
+        images.ensure_image(client, "proxy")
+        self.assertEqual(client.mock_calls, [])
+
+    def test_unchanged_digest_is_not_pulled(self):
+        client = mock.Mock()
+        client.images.get_registry_data.return_value.id = "sha256:abc"
+        client.images.get.return_value.attrs = {"RepoDigests": ["proxy@sha256:abc"]}
+        self.assertFalse(images.refresh_image(client, "proxy"))
+        client.images.pull.assert_not_called()
+        self.assertEqual(models.ContainerImage.objects.get().digest, "sha256:abc")
+
+
+class DockerClientTests(TestCase):
+    def tearDown(self):
+        docker_client.reset_client()
+
+    @mock.patch("docker.DockerClient.from_env")
+    def test_client_per_process(self, from_env):
+        from_env.side_effect = lambda **kwargs: mock.Mock()
+        first = docker_client.get_client()
+        self.assertIs(docker_client.get_client(), first)
+        with mock.patch("os.getpid", return_value=-1):
+            self.assertIsNot(docker_client.get_client(), first)
+
+    @mock.patch("docker.DockerClient")
+    def test_client_per_endpoint(self, client_class):
+        client_class.side_effect = lambda **kwargs: mock.Mock()
+        first = models.DockerHost(name="a", endpoint="tcp://a:2375", hostname="a")
+        second = models.DockerHost(name="b", endpoint="tcp://b:2375", hostname="b")
+        client = docker_client.get_client(first)
+        self.assertIs(docker_client.get_client(first), client)
+        self.assertIsNot(docker_client.get_client(second), client)
+        self.assertEqual(client_class.call_args.kwargs["base_url"], "tcp://b:2375")
+        docker_client.reset_client(first)
+        client.close.assert_called_once()
+        self.assertIsNot(docker_client.get_client(first), client)
+
+
+class ChallengeListTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            username="student", password="foo", student_number="s1234567"
+        )
+        self.other = get_user_model().objects.create_user(
+            username="other", password="foo", student_number="s7654321"
+        )
+        self.client.force_login(self.user)
+
+    def add_challenges(self, count):
+        for i in range(count):
+            challenge = models.Challenge.objects.create(
+                title=f"Challenge {i}",
+                description="",
+                solution="",
+                container="stack",
+                end_time=timezone.now() + timedelta(days=1),
+            )
+            models.ChallengeEntry.objects.create(
+                challenge=challenge,
+                user=self.user,
+                completion_time=timezone.now(),
+                writeup="done",
+            )
+            models.ChallengeEntry.objects.create(challenge=challenge, user=self.other)
+
+    def list_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("challenges:challenges"))
+        return response, len(queries)
+
+    def test_constant_queries(self):
+        self.add_challenges(1)
+        _response, few = self.list_queries()
+        self.add_challenges(10)
+        response, many = self.list_queries()
+        self.assertEqual(few, many)
+        self.assertContains(response, "Started by 2 students")
+        self.assertContains(response, "Completed by 1 student<")
+        self.assertContains(response, "(Completed at")
+
+
+class NetworkPairTests(TestCase):
+    def setUp(self):
+        self.docker = mock.Mock()
+        self.pair = models.NetworkPair.objects.create(
+            internal_id="int", internal_name="int", public_id="pub", public_name="pub"
+        )
+
+    def test_lease_and_release(self):
+        leased = models.NetworkPair.lease(self.docker, "proc")
+        self.assertEqual(leased.pk, self.pair.pk)
+        self.docker.networks.create.assert_not_called()
+
+        network = self.docker.networks.get.return_value
+        network.attrs = {"Containers": {"vuln": {}}}
+        models.NetworkPair.release(self.docker, "proc")
+        network.disconnect.assert_called_with("vuln", force=True)
+        network.remove.assert_not_called()
+        self.pair.refresh_from_db()
+        self.assertEqual(self.pair.process_identifier, "")
+
+    def test_reap_leaked_lease(self):
+        models.NetworkPair.objects.filter(pk=self.pair.pk).update(
+            process_identifier="gone", leased=timezone.now() - timedelta(hours=1)
+        )
+        self.docker.networks.get.return_value.attrs = {}
+        models.NetworkPair.reap(self.docker)
+        self.pair.refresh_from_db()
+        self.assertEqual(self.pair.process_identifier, "")
+
+
+class MarkdownTests(TestCase):
+    def test_rendered_once_per_text(self):
+        with mock.patch(
+            "markdown.Markdown.convert", return_value="<p>x</p>"
+        ) as convert:
+            first = rendering.markdownize("cached *text*")
+            second = rendering.markdownize("cached *text*")
+            rendering.markdownize("edited *text*")
+        self.assertEqual(first, second)
+        self.assertEqual(convert.call_count, 2)
+
+    def test_render(self):
+        self.assertEqual(rendering.markdownize("*hi*"), "<p><em>hi</em></p>")
+        self.assertEqual(rendering.markdownize(None), "")
+
+
+class SubmitWriteupTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            username="student", password="foo", student_number="s1234567"
+        )
+        self.challenge = models.Challenge.objects.create(
+            title="Stack smash",
+            description="",
+            solution="",
+            container="stack",
+            end_time=timezone.now() + timedelta(days=1),
+        )
+        self.url = reverse(
+            "challenges:submit_writeup", kwargs={"pk": self.challenge.pk}
+        )
+        self.client.force_login(self.user)
+
+    def save(self, writeup, **data):
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.post(self.url, {"writeup": writeup, **data}).json()
+        writes = [q for q in queries if q["sql"].startswith(("UPDATE", "INSERT"))]
+        return data, writes
+
+    def test_unchanged_writeup_is_not_written(self):
+        data, writes = self.save("*first*")
+        self.assertTrue(data["saved"])
+        self.assertIn("<em>first</em>", data["preview_html"])
+        self.assertEqual(
+            models.ChallengeEntry.objects.get(user=self.user).writeup, "*first*"
+        )
+
+        data, writes = self.save("*first*")
+        self.assertTrue(data["saved"])
+        self.assertIn("<em>first</em>", data["preview_html"])
+        self.assertEqual(writes, [])
+
+    def test_detail_shows_writeup(self):
+        self.save("*first*")
+        response = self.client.get(
+            reverse("challenges:challenge", kwargs={"pk": self.challenge.pk})
+        )
+        self.assertContains(
+            response, '<div id="writeup-preview"><p><em>first</em></p></div>', html=True
+        )
+
+    def test_saves_are_coalesced(self):
+        self.save("first")
+        data, writes = self.save("second")
+        self.assertFalse(data["saved"])
+        self.assertEqual(writes, [])
+
+        cache.delete(f"writeup:{self.user.pk}:{self.challenge.pk}:saved")
+        data, writes = self.save("second")
+        self.assertTrue(data["saved"])
+        self.assertEqual(len(writes), 1)
+        self.assertEqual(
+            models.ChallengeEntry.objects.get(user=self.user).writeup, "second"
+        )
+
+    def test_forced_save_is_written(self):
+        self.save("first")
+        data, writes = self.save("second", force="1")
+        self.assertTrue(data["saved"])
+        self.assertEqual(len(writes), 1)
+        self.assertEqual(
+            models.ChallengeEntry.objects.get(user=self.user).writeup, "second"
+        )
+
+
+class CollectResultsTests(TestCase):
+    def setUp(self):
+        self.challenge = models.Challenge.objects.create(
+            title="Stack smash",
+            description="",
+            solution="",
+            container="stack",
+            end_time=timezone.now() + timedelta(days=1),
+        )
+        self.add_entries(range(3))
+
+    def add_entries(self, numbers):
+        for i in numbers:
+            user = get_user_model().objects.create_user(
+                username=f"student{i}",
+                password="foo",
+                student_number=f"s{i:07}",
+                first_name="Student",
+                last_name=str(i),
+            )
+            entry = models.ChallengeEntry.objects.create(
+                challenge=self.challenge, user=user, writeup="writeup"
+            )
+            models.ChallengeProcess.objects.create(
+                challenge_entry=entry, process_identifier=f"proc{i}"
+            )
+
+    def test_archive(self):
+        with TemporaryDirectory() as tmp, override_settings(MEDIA_ROOT=Path(tmp)):
+            logdir = Path(tmp) / "logs" / "proc1"
+            logdir.mkdir(parents=True)
+            (logdir / "challenge.log").write_text('-> "AAAA"\n')
+            archive = Path(tmp) / "out.zip"
+            call_command("collectresults", archive=archive, chunk_size=2)
+            with zipfile.ZipFile(archive) as f:
+                names = set(f.namelist())
+                log = f.read("s0000001_student-1/stack-smash/log-0.log")
+                link = f.read("s0000002_student-2/stack-smash/challenge.md")
+        self.assertEqual(len(names), 8)
+        self.assertIn("s0000000_student-0/stack-smash/writeup.md", names)
+        self.assertIn("challenges/stack-smash/challenge.md", names)
+        self.assertEqual(log, b'-> "AAAA"\n')
+        self.assertEqual(link, b"../../challenges/stack-smash/challenge.md")
+
+    @skipIf(collect.zstandard is None, "zstandard is not installed")
+    def test_zstd_archive(self):
+        with TemporaryDirectory() as tmp, override_settings(MEDIA_ROOT=Path(tmp)):
+            logdir = Path(tmp) / "logs" / "proc1"
+            logdir.mkdir(parents=True)
+            (logdir / "challenge.log").write_text('-> "AAAA"\n')
+            archive = Path(tmp) / "out.tar.zst"
+            call_command("collectresults", archive=archive, chunk_size=2)
+            decompressor = collect.zstandard.ZstdDecompressor()
+            with archive.open("rb") as compressed:
+                data = io.BytesIO(decompressor.stream_reader(compressed).read())
+        with tarfile.open(fileobj=data) as f:
+            members = {
+                member.name: (
+                    f.extractfile(member).read() if member.isfile() else member.linkname
+                )
+                for member in f
+            }
+        self.assertEqual(len(members), 8)
+        self.assertEqual(
+            members["s0000001_student-1/stack-smash/log-0.log"], b'-> "AAAA"\n'
+        )
+        self.assertEqual(
+            members["s0000002_student-2/stack-smash/challenge.md"],
+            "challenges/stack-smash/challenge.md",
+        )
+
+    def test_shared_challenge(self):
+        cwd = os.getcwd()
+        with TemporaryDirectory() as tmp, override_settings(MEDIA_ROOT=Path(tmp)):
+            os.chdir(tmp)
+            self.addCleanup(os.chdir, cwd)
+            with mock.patch(
+                "django.template.loader.get_template", wraps=loader.get_template
+            ) as get_template:
+                call_command("collectresults")
+            rendered = [call.args[0] for call in get_template.call_args_list]
+            self.assertEqual(rendered.count("challenges/collect/challenge.md"), 1)
+            shared = Path("collected/challenges/stack-smash/challenge.md").stat()
+            copy = Path("collected/s0000001_student-1/stack-smash/challenge.md").stat()
+            self.assertEqual(shared.st_ino, copy.st_ino)
+            self.assertEqual(shared.st_nlink, 4)
+
+            call_command("collectresults", archive=Path("out.tar.gz"))
+            with tarfile.open("out.tar.gz") as f:
+                member = f.getmember("s0000001_student-1/stack-smash/challenge.md")
+                self.assertTrue(member.islnk())
+                self.assertEqual(member.linkname, "challenges/stack-smash/challenge.md")
+
+    def test_incremental(self):
+        cwd = os.getcwd()
+        with TemporaryDirectory() as tmp, override_settings(MEDIA_ROOT=Path(tmp)):
+            os.chdir(tmp)
+            self.addCleanup(os.chdir, cwd)
+            call_command("collectresults")
+            with self.assertRaises(CommandError):
+                call_command("collectresults")
+
+            entry = models.ChallengeEntry.objects.get(user__username="student0")
+            entry.writeup = "updated"
+            entry.save()
+            models.ChallengeEntry.objects.filter(user__username="student1").delete()
+            with mock.patch(
+                "challenges.collect.export_entry", wraps=collect.export_entry
+            ) as export_entry:
+                call_command("collectresults", incremental=True)
+            self.assertEqual(export_entry.call_count, 1)
+
+            collected = Path("collected")
+            writeup = collected / "s0000000_student-0/stack-smash/writeup.md"
+            self.assertIn("updated", writeup.read_text())
+            self.assertFalse((collected / "s0000001_student-1").exists())
+
+    def export_queries(self, tmp, **options):
+        archive = Path(tmp) / "out.zip"
+        with CaptureQueriesContext(connection) as queries:
+            call_command("collectresults", archive=archive, **options)
+        with zipfile.ZipFile(archive) as f:
+            users = {name.split("/")[0] for name in f.namelist()}
+        return len(queries), users - {"challenges"}
+
+    def test_constant_queries(self):
+        with TemporaryDirectory() as tmp, override_settings(MEDIA_ROOT=Path(tmp)):
+            few, _users = self.export_queries(tmp)
+            self.add_entries(range(3, 20))
+            many, users = self.export_queries(tmp)
+        self.assertEqual(few, many)
+        self.assertEqual(len(users), 20)
+
+    def test_filters(self):
+        models.ChallengeEntry.objects.filter(user__username="student1").update(
+            completion_time=timezone.now() - timedelta(hours=1)
+        )
+        with TemporaryDirectory() as tmp, override_settings(MEDIA_ROOT=Path(tmp)):
+            _queries, users = self.export_queries(tmp, user=["student0", "student2"])
+            self.assertEqual(users, {"s0000000_student-0", "s0000002_student-2"})
+            _queries, users = self.export_queries(
+                tmp, completed_after=timezone.now() - timedelta(days=1)
+            )
+            self.assertEqual(users, {"s0000001_student-1"})
+            _queries, users = self.export_queries(
+                tmp, challenge=[self.challenge.pk + 1]
+            )
+            self.assertEqual(users, set())
+
+
+class ParallelCollectResultsTests(TransactionTestCase):
+    """Workers are separate processes, so the entries have to be committed"""
+
+    setUp = CollectResultsTests.setUp
+    add_entries = CollectResultsTests.add_entries
+
+    def export(self, tmp, name, **options):
+        archive = Path(tmp) / name
+        call_command("collectresults", archive=archive, chunk_size=2, **options)
+        with zipfile.ZipFile(archive) as f:
+            return {name: f.read(name) for name in f.namelist()}
+
+    def test_matches_serial(self):
+        self.add_entries(range(3, 7))
+        with TemporaryDirectory() as tmp, override_settings(MEDIA_ROOT=Path(tmp)):
+            logdir = Path(tmp) / "logs" / "proc5"
+            logdir.mkdir(parents=True)
+            (logdir / "challenge.log").write_text('-> "AAAA"\n')
+            serial = self.export(tmp, "serial.zip")
+            parallel = self.export(tmp, "parallel.zip", jobs=2)
+        self.assertEqual(parallel, serial)
+        self.assertIn("s0000005_student-5/stack-smash/log-0.log", parallel)
+        self.assertEqual(len(parallel), 16)
+
+
+class TranscriptTests(TestCase):
+    TRANSCRIPT = (
+        '<- "Welcome"\n'
+        "** First byte read at 2024-01-08T10:00:00+01:00\n"
+        '-> "AAAA%p%p"\n'
+        "-> 0x41414141efbeadde0a\n"
+        "** closed input\n"
+    )
+
+    def setUp(self):
+        tmp = TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = Path(tmp.name)
+        self.log = self.tmp / "logs" / "proc0" / "challenge.log"
+        self.log.parent.mkdir(parents=True)
+        self.log.write_text(self.TRANSCRIPT)
+        self.index = transcripts.TranscriptIndex(self.tmp / "index.sqlite3")
+        self.addCleanup(self.index.close)
+
+    def ingest(self):
+        return transcripts.ingest_all(self.index, self.tmp / "logs")
+
+    def test_parse(self):
+        self.assertEqual(self.ingest(), 3)
+        records = self.index.search("AAAA")
+        self.assertEqual(len(records), 2)
+        text, binary = records
+        self.assertEqual(text.direction, "->")
+        self.assertEqual(text.payload, "AAAA%p%p")
+        self.assertEqual(text.timestamp, "2024-01-08T10:00:00+01:00")
+        self.assertEqual(binary.encoding, "hex")
+        self.assertEqual(binary.hex, "41414141efbeadde0a")
+        self.assertEqual(self.index.search("efbead"), [binary])
+        with self.assertRaises(ValueError):
+            self.index.search("AA")
+
+    def test_upgrade_old_index(self):
+        path = self.tmp / "old.sqlite3"
+        with sqlite3.connect(path) as old:
+            old.execute(
+                "CREATE TABLE logs (process_identifier TEXT PRIMARY KEY, "
+                "offset INTEGER NOT NULL, timestamp TEXT)"
+            )
+            old.execute("INSERT INTO logs VALUES ('proc0', 13, NULL)")
+        old.close()
+        with transcripts.TranscriptIndex(path) as index:
+            self.assertEqual(index.position("proc0"), (13, None, None))
+            # Continues after the welcome line that was already ingested
+            self.assertEqual(transcripts.ingest_all(index, self.tmp / "logs"), 2)
+
+    def test_incremental(self):
+        self.ingest()
+        with open(self.log, "a") as f:
+            f.write('<- "Bye"\n-> "partial')
+        self.assertEqual(self.ingest(), 1)
+        with open(self.log, "a") as f:
+            f.write(' line"\n')
+        self.assertEqual(self.ingest(), 1)
+        self.assertEqual(self.ingest(), 0)
+        (record,) = self.index.search("partial line")
+        self.assertEqual(record.offset, len(self.TRANSCRIPT) + len('<- "Bye"\n'))
+
+        self.log.write_text('-> "AAAA again"\n')
+        self.assertEqual(self.ingest(), 1)
+        self.assertEqual(len(self.index.search("AAAA")), 1)
+
+    def test_admin_search(self):
+        self.ingest()
+        user = get_user_model().objects.create_superuser(
+            username="admin", password="foo", student_number="s0000000"
+        )
+        self.client.force_login(user)
+        url = reverse("admin:challenges_challengeprocess_transcripts")
+        with override_settings(TRANSCRIPT_INDEX=self.tmp / "index.sqlite3"):
+            response = self.client.get(url, {"q": "%p%p"})
+            self.assertContains(response, "AAAA%p%p")
+            response = self.client.get(url, {"q": "p"})
+            self.assertContains(response, "at least three characters")
+
+
+@override_settings(
+    LOG_COMPRESS_AFTER=60, LOG_MAX_AGE=24 * 60 * 60, LOG_MAX_TOTAL_SIZE=None
+)
+class LogLifecycleTests(TestCase):
+    def setUp(self):
+        tmp = TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.media = Path(tmp.name)
+        settings = override_settings(MEDIA_ROOT=self.media)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.now = time.time()
+
+    def add_log(self, process_identifier, age, contents=b'-> "AAAA"\n' * 100):
+        path = self.media / "logs" / process_identifier / "challenge.log"
+        path.parent.mkdir(parents=True)
+        path.write_bytes(contents)
+        os.utime(path, (self.now - age, self.now - age))
+        return path
+
+    def test_compress_stopped(self):
+        entry = models.ChallengeEntry.objects.create(
+            challenge=models.Challenge.objects.create(
+                title="Stack smash",
+                description="",
+                solution="",
+                container="stack",
+                end_time=timezone.now() + timedelta(days=1),
+            ),
+            user=get_user_model().objects.create_user(
+                username="student", password="foo", student_number="s0000000"
+            ),
+        )
+        models.ChallengeProcess.objects.create(
+            challenge_entry=entry, process_identifier="running", running=True
+        )
+        running = self.add_log("running", 3600)
+        recent = self.add_log("recent", 10)
+        stopped = self.add_log("stopped", 3600)
+
+        result = logs.apply_lifecycle(now=self.now)
+        self.assertEqual(result.compressed, 1)
+        self.assertTrue(running.exists())
+        self.assertTrue(recent.exists())
+        self.assertFalse(stopped.exists())
+        compressed = logs.find_log(stopped.parent)
+        self.assertEqual(compressed.name, "challenge.log.gz")
+        self.assertEqual(compressed.stat().st_mtime, self.now - 3600)
+        with logs.open_log(compressed) as f:
+            self.assertEqual(f.read(), b'-> "AAAA"\n' * 100)
+
+        # Compressing does not make the directory look recent
+        result = logs.apply_lifecycle(now=self.now + 2 * 24 * 60 * 60)
+        self.assertEqual(result.removed, 2)
+        self.assertFalse(stopped.parent.exists())
+        self.assertTrue(running.exists())
+
+    def test_total_size(self):
+        for i in range(4):
+            self.add_log(f"proc{i}", 3600 - i, os.urandom(1000))
+        with override_settings(LOG_MAX_TOTAL_SIZE=2500):
+            result = logs.apply_lifecycle(now=self.now)
+        self.assertEqual(result.removed, 2)
+        self.assertEqual(
+            sorted(path.name for path in (self.media / "logs").iterdir()),
+            ["proc2", "proc3"],
+        )
+
+    @override_settings(LOG_COMPRESS_AFTER=None)
+    def test_without_compression(self):
+        stopped = self.add_log("stopped", 3600)
+        expired = self.add_log("expired", 2 * 24 * 60 * 60)
+        result = logs.apply_lifecycle(now=self.now)
+        self.assertEqual(result.compressed, 0)
+        self.assertEqual(result.removed, 1)
+        self.assertTrue(stopped.exists())
+        self.assertFalse(expired.exists())
+
+    def test_read_compressed(self):
+        path = self.add_log("proc0", 3600)
+        index = transcripts.TranscriptIndex(self.media / "index.sqlite3")
+        self.addCleanup(index.close)
+        with open(path, "ab") as f:
+            f.write(b'-> "BBBB"\n')
+        self.assertEqual(transcripts.ingest_all(index), 101)
+        logs.compress(path)
+        self.assertEqual(transcripts.ingest_all(index), 0)
+        self.assertEqual(len(index.search("BBBB")), 1)
+
+        writer = collect.DirectoryWriter(self.media / "out")
+        writer.add(PurePosixPath("log.log"), logs.find_log(path.parent))
+        self.assertEqual((self.media / "out/log.log").read_bytes().count(b"\n"), 101)
+
+        writer = collect.TarWriter(self.media / "out.tar")
+        writer.add(PurePosixPath("log.log"), logs.find_log(path.parent))
+        writer.close()
+        with tarfile.open(self.media / "out.tar") as f:
+            self.assertEqual(f.extractfile("log.log").read().count(b"\n"), 101)
+
+
+class SimilarityTests(TestCase):
+    WRITEUP = (
+        "The program reads the name with gets, so a long name overflows the "
+        "buffer. After {} bytes of padding we overwrite the return address "
+        "with the address of the win function and get the flag."
+    )
+
+    def setUp(self):
+        self.challenge = models.Challenge.objects.create(
+            title="Stack smash",
+            description="",
+            solution="",
+            container="stack",
+            end_time=timezone.now() + timedelta(days=1),
+        )
+        writeups = [
+            self.WRITEUP.format(40),
+            self.WRITEUP.format(48),
+            "I leaked the canary with a format string and returned to system.",
+            "",
+        ]
+        self.entries = []
+        for i, writeup in enumerate(writeups):
+            user = get_user_model().objects.create_user(
+                username=f"student{i}", password="foo", student_number=f"s{i:07}"
+            )
+            self.entries.append(
+                models.ChallengeEntry.objects.create(
+                    challenge=self.challenge, user=user, writeup=writeup
+                )
+            )
+
+    def test_python_signatures(self):
+        shingles = [similarity.shingles(entry.writeup) for entry in self.entries[:3]]
+        expected = similarity.signatures(shingles)
+        score = similarity.similarity(expected[0], expected[1])
+        with mock.patch("challenges.similarity.numpy", None):
+            self.assertEqual(similarity.signatures(shingles), expected)
+            self.assertEqual(similarity.similarity(expected[0], expected[1]), score)
+
+    @skipIf(similarity.numpy is None, "numpy is not installed")
+    def test_numpy_signatures(self):
+        shingles = [similarity.shingles(entry.writeup) for entry in self.entries[:3]]
+        expected = [similarity._signature_python(values) for values in shingles]
+        self.assertEqual(similarity._signatures_numpy(shingles), expected)
+        # Small batches split the writeups over several NumPy calls
+        with mock.patch("challenges.similarity.BATCH_SHINGLES", 20):
+            self.assertEqual(similarity.signatures(shingles), expected)
+
+    def test_clusters(self):
+        entries = models.ChallengeEntry.objects.all()
+        self.assertEqual(similarity.update_signatures(entries), 3)
+        self.assertEqual(similarity.update_signatures(entries), 0)
+        first = self.entries[0]
+        first.writeup += " Thanks!"
+        first.save()
+        self.assertEqual(similarity.update_signatures(entries), 1)
+
+        ((cluster, pairs),) = similarity.challenge_clusters(self.challenge)
+        self.assertEqual(cluster, self.entries[:2])
+        self.assertGreater(pairs[0][2], 0.5)
+
+        output = io.StringIO()
+        call_command("similar_writeups", stdout=output)
+        self.assertIn("Stack smash: 1 clusters", output.getvalue())
+        self.assertIn("s0000000 (student0), s0000001 (student1)", output.getvalue())
+
+
+class FingerprintTests(TestCase):
+    def setUp(self):
+        tmp = TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        settings = override_settings(MEDIA_ROOT=Path(tmp.name))
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.challenge = models.Challenge.objects.create(
+            title="Stack smash",
+            description="",
+            solution="",
+            container="stack",
+            end_time=timezone.now() + timedelta(days=1),
+        )
+
+    def add_transcript(self, number, transcript):
+        user = get_user_model().objects.create_user(
+            username=f"student{number}",
+            password="foo",
+            student_number=f"s{number:07}",
+        )
+        entry = models.ChallengeEntry.objects.create(
+            challenge=self.challenge, user=user
+        )
+        models.ChallengeProcess.objects.create(
+            challenge_entry=entry, process_identifier=f"proc{number}"
+        )
+        path = logs.log_root() / f"proc{number}" / "challenge.log"
+        path.parent.mkdir(parents=True)
+        path.write_bytes(transcript)
+        return path
+
+    def exploit(self, padding):
+        payload = b"A" * padding + bytes.fromhex("efbeadde00000000") + b"\n"
+        return b'-> "ls"\n-> 0x' + payload.hex().encode() + b"\n"
+
+    def test_normalize(self):
+        self.assertEqual(
+            fingerprints.normalize(b"A" * 40 + b"\xef\xbe\xad\xde\n"),
+            b"A*\xef\xbe\xad\xde",
+        )
+        self.assertIsNone(fingerprints.normalize(b"ls\n"))
+
+    def test_matches(self):
+        self.add_transcript(0, self.exploit(40))
+        # Compressed logs are read as well
+        logs.compress(self.add_transcript(1, self.exploit(72)))
+        self.add_transcript(2, b'<- "name?"\n-> "' + b"B" * 60 + b'"\n')
+        output = io.StringIO()
+        call_command("similar_transcripts", stdout=output)
+        lines = output.getvalue().splitlines()
+        self.assertEqual(
+            lines[0],
+            "Stack smash: s0000000 (student0) and s0000001 (student1) "
+            "sent 1 identical payloads",
+        )
+        self.assertEqual(len(lines), 2)
+
+        found, examples = fingerprints.scan()
+        self.assertEqual(fingerprints.find_matches(found, examples, 1), [])
+
+
+class SubmitFlagTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            username="student", password="foo", student_number="s1234567"
+        )
+        self.challenge = models.Challenge.objects.create(
+            title="Stack smash",
+            description="",
+            solution="",
+            container="stack",
+            end_time=timezone.now() + timedelta(days=1),
+        )
+        self.entry = models.ChallengeEntry.objects.create(
+            challenge=self.challenge, user=self.user
+        )
+        self.url = reverse("challenges:submit_flag", kwargs={"pk": self.challenge.pk})
+        self.client.force_login(self.user)
+        clock = mock.patch("challenges.ratelimit.time.time", return_value=1000.0)
+        self.time = clock.start()
+        self.addCleanup(clock.stop)
+
+    def submit(self, flag):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.url, {"flag": flag})
+        challenge_queries = [q for q in queries if "challenges_" in q["sql"]]
+        return response, challenge_queries
+
+    def test_first_success_counts(self):
+        response, _queries = self.submit(self.entry.flag)
+        self.assertTrue(response.json()["correct"])
+        self.entry.refresh_from_db()
+        completed = self.entry.completion_time
+        self.assertIsNotNone(completed)
+
+        response, queries = self.submit(self.entry.flag)
+        self.assertTrue(response.json()["correct"])
+        self.entry.refresh_from_db()
+        self.assertEqual(self.entry.completion_time, completed)
+        (update,) = [q for q in queries if q["sql"].startswith("UPDATE")]
+        self.assertIn("IS NULL", update["sql"])
+
+    def test_repeated_wrong_guess(self):
+        response, queries = self.submit("HiCCTF{wrong}")
+        self.assertFalse(response.json()["correct"])
+        self.assertTrue(queries)
+        response, queries = self.submit("HiCCTF{wrong}")
+        self.assertFalse(response.json()["correct"])
+        self.assertEqual(queries, [])
+
+    @override_settings(FLAG_RATE=1, FLAG_BURST=5)
+    def test_flood(self):
+        responses = []
+        for i in range(100):
+            response, queries = self.submit(f"HiCCTF{{guess{i}}}")
+            responses.append(response.status_code)
+            if response.status_code == 429:
+                self.assertEqual(queries, [])
+                self.assertEqual(response.json()["retry_after"], 1)
+        self.assertEqual(responses.count(200), 5)
+
+        self.time.return_value = 1002.0
+        response, _queries = self.submit(self.entry.flag)
+        self.assertTrue(response.json()["correct"])
+
+    def test_concurrent_takes(self):
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            waits = list(
+                executor.map(lambda _i: ratelimit.take("concurrent", 1, 5), range(40))
+            )
+        self.assertEqual(waits.count(0), 5)
+        self.assertEqual(min(wait for wait in waits if wait), 1)
+
+
+class AdmissionTests(TestCase):
+    def setUp(self):
+        self.challenges = [
+            models.Challenge.objects.create(
+                title=f"Challenge {i}",
+                description="",
+                solution="",
+                container="stack",
+                end_time=timezone.now() + timedelta(days=1),
+            )
+            for i in range(2)
+        ]
+        self.users = [
+            get_user_model().objects.create_user(
+                username=f"student{i}", password="foo", student_number=f"s{i:07}"
+            )
+            for i in range(3)
+        ]
+
+    def entry(self, user, challenge=0):
+        return models.ChallengeEntry.objects.get_or_create(
+            user=self.users[user], challenge=self.challenges[challenge]
+        )[0]
+
+    def start(self, user, challenge=0):
+        return models.ChallengeJob.enqueue_start(self.entry(user, challenge))
+
+    def run_process(self, user, challenge=0, **kwargs):
+        return models.ChallengeProcess.objects.create(
+            challenge_entry=self.entry(user, challenge),
+            process_identifier=f"proc{user}_{challenge}",
+            running=True,
+            **kwargs,
+        )
+
+    def test_resources(self):
+        resources = admission.process_resources(self.challenges[0])
+        self.assertAlmostEqual(resources.cpu, 0.15)
+        self.assertEqual(resources.memory, 250 * 1024 * 1024)
+        self.assertEqual(resources.pids, 100)
+        self.assertEqual(resources.subnets, 2)
+
+    def test_fair_share(self):
+        first = self.start(0, 0)
+        second = self.start(0, 1)
+        other = self.start(1, 0)
+        order = admission.queue_order(admission.queued_starts())
+        self.assertEqual(order, [first, other, second])
+
+        # Running a process counts like an earlier queued start
+        self.run_process(1, 1)
+        self.assertEqual(admission.queue_position(other), 3)
+        self.client.force_login(self.users[1])
+        url = reverse("challenges:job", kwargs={"pk": other.pk})
+        self.assertEqual(self.client.get(url).json()["position"], 3)
+
+    @override_settings(ADMISSION_MEMORY=600 * 1024 * 1024)
+    def test_waits_for_capacity(self):
+        self.run_process(2)
+        self.start(0)
+        waiting = self.start(1)
+        stop = models.ChallengeJob.enqueue_stop(
+            models.ChallengeProcess(process_identifier="stopped")
+        )
+        claimed = models.ChallengeJob.claim(5)
+        self.assertEqual(claimed[0], stop)
+        self.assertEqual(len(claimed), 2)
+        self.assertEqual(models.ChallengeJob.claim(5), [])
+        # The claimed start counts until it has created its process
+        self.run_process(0)
+        models.ChallengeJob.objects.filter(pk=claimed[1].pk).update(
+            status=models.ChallengeJob.DONE
+        )
+        self.assertEqual(models.ChallengeJob.claim(5), [])
+        models.ChallengeProcess.objects.filter(process_identifier="proc2_0").update(
+            running=False
+        )
+        self.assertEqual(models.ChallengeJob.claim(5), [waiting])
+
+    @override_settings(ADMISSION_MEMORY=300 * 1024 * 1024, ADMISSION_EVICT_IDLE=60)
+    def test_evict_idle(self):
+        with TemporaryDirectory() as tmp, override_settings(MEDIA_ROOT=Path(tmp)):
+            busy = self.run_process(1)
+            log = logs.log_root() / busy.process_identifier / "challenge.log"
+            log.parent.mkdir(parents=True)
+            log.write_text('-> "AAAA"\n')
+            models.ChallengeProcess.objects.filter(pk=busy.pk).update(
+                started=timezone.now() - timedelta(hours=2)
+            )
+            job = self.start(0)
+            self.assertEqual(models.ChallengeJob.claim(5), [])
+
+            models.ChallengeProcess.objects.filter(pk=busy.pk).update(running=False)
+            idle = self.run_process(2)
+            models.ChallengeProcess.objects.filter(pk=idle.pk).update(
+                started=timezone.now() - timedelta(hours=2)
+            )
+            self.assertEqual(models.ChallengeJob.claim(5), [job])
+        self.assertFalse(models.ChallengeProcess.objects.filter(pk=idle.pk).exists())
+        self.assertTrue(
+            models.ChallengeJob.objects.filter(
+                action=models.ChallengeJob.STOP,
+                process_identifier=idle.process_identifier,
+            ).exists()
+        )
+
+    @override_settings(ADMISSION_MEMORY=750 * 1024 * 1024, ADMISSION_EVICT_IDLE=60)
+    def test_evict_on_placement_host(self):
+        hosts = [
+            models.DockerHost.objects.create(name=f"vm{i}", hostname=f"vm{i}")
+            for i in range(2)
+        ]
+        with TemporaryDirectory() as tmp, override_settings(MEDIA_ROOT=Path(tmp)):
+            # The other host is busier, but its processes were idle longer
+            oldest = self.run_process(0, 0, host=hosts[1])
+            self.run_process(0, 1, host=hosts[1])
+            target = self.run_process(1, 0, host=hosts[0])
+            models.ChallengeProcess.objects.filter(pk=oldest.pk).update(
+                started=timezone.now() - timedelta(hours=3)
+            )
+            models.ChallengeProcess.objects.exclude(pk=oldest.pk).update(
+                started=timezone.now() - timedelta(hours=2)
+            )
+            job = self.start(2)
+            self.assertEqual(models.ChallengeJob.claim(5), [job])
+        running = models.ChallengeProcess.objects.values_list("pk", flat=True)
+        self.assertNotIn(target.pk, running)
+        self.assertIn(oldest.pk, running)
+        stop = models.ChallengeJob.objects.get(action=models.ChallengeJob.STOP)
+        self.assertEqual(stop.host, hosts[0])
+
+
+class PlacementTests(TestCase):
+    def setUp(self):
+        self.challenge = models.Challenge.objects.create(
+            title="Stack smash",
+            description="",
+            solution="",
+            container="stack",
+            end_time=timezone.now() + timedelta(days=1),
+            listen_ports=[{"port": 1337, "description": "direct", "logged": False}],
+        )
+        self.user = get_user_model().objects.create_user(
+            username="student", password="foo", student_number="s1234567"
+        )
+        self.entry = models.ChallengeEntry.objects.create(
+            challenge=self.challenge, user=self.user
+        )
+        self.hosts = [
+            models.DockerHost.objects.create(
+                name=f"vm{i}",
+                endpoint=f"tcp://10.0.0.{i}:2375",
+                hostname=f"vm{i}.example.com",
+                capacity=10,
+            )
+            for i in range(2)
+        ]
+        # A fake backend: every host gets its own client
+        self.clients = {host.pk: mock.MagicMock() for host in self.hosts}
+        patcher = mock.patch(
+            "challenges.docker_client.get_client",
+            side_effect=lambda host=None: self.clients[host.pk],
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def run_process(self, host, name="proc"):
+        return models.ChallengeProcess.objects.create(
+            challenge_entry=self.entry,
+            process_identifier=name,
+            running=True,
+            host=host,
+        )
+
+    def test_default_host_without_registry(self):
+        models.DockerHost.objects.all().delete()
+        self.assertIsNone(placement.place(self.challenge))
+        self.assertIsNone(placement.free_slots())
+        self.assertEqual(placement.hosts(), [None])
+
+    def test_least_loaded(self):
+        self.run_process(self.hosts[0])
+        self.assertEqual(placement.place(self.challenge), self.hosts[1])
+        self.assertEqual(placement.free_slots(), 19)
+
+    def test_image_affinity(self):
+        models.ContainerImage.objects.create(
+            reference=f"{self.challenge.image}:latest",
+            host=self.hosts[0],
+            digest="sha256:abc",
+            checked=timezone.now(),
+        )
+        self.run_process(self.hosts[0])
+        self.assertEqual(placement.place(self.challenge), self.hosts[0])
+        self.run_process(self.hosts[0], "second")
+        self.assertEqual(placement.place(self.challenge), self.hosts[1])
+
+    def test_full_hosts(self):
+        self.hosts[1].enabled = False
+        self.hosts[1].save()
+        self.hosts[0].capacity = 1
+        self.hosts[0].save()
+        self.run_process(self.hosts[0])
+        with self.assertRaises(placement.NoCapacity):
+            placement.place(self.challenge)
+        models.ChallengeJob.enqueue_start(self.entry)
+        self.assertEqual(admission.admit(admission.queued_starts(), 5), [])
+
+    @mock.patch("challenges.images.ensure_image")
+    def test_start_and_stop_on_host(self, _ensure_image):
+        self.run_process(self.hosts[0], "busy")
+        pairs = [
+            models.NetworkPair.objects.create(
+                internal_id="int",
+                internal_name="int",
+                public_id="pub",
+                public_name="pub",
+                host=host,
+            )
+            for host in self.hosts
+        ]
+        client = self.clients[self.hosts[1].pk]
+        client.containers.run.return_value = mock.Mock(
+            ports={"1337/tcp": [{"HostPort": "4242"}]}
+        )
+        job = models.ChallengeJob.enqueue_start(self.entry)
+        with TemporaryDirectory() as media, override_settings(MEDIA_ROOT=Path(media)):
+            job.run()
+
+        self.assertEqual(job.status, models.ChallengeJob.DONE)
+        self.assertEqual(job.process.host, self.hosts[1])
+        self.assertEqual(job.process.hostname, "vm1.example.com")
+        self.assertEqual(
+            models.NetworkPair.leased_by(job.process.process_identifier), pairs[1]
+        )
+        self.clients[self.hosts[0].pk].containers.run.assert_not_called()
+
+        stop = models.ChallengeJob.enqueue_stop(job.process)
+        self.assertEqual(stop.host, self.hosts[1])
+        client.containers.list.reset_mock()
+        stop.run()
+        client.containers.list.assert_called()
+        self.clients[self.hosts[0].pk].containers.list.assert_not_called()
+
+    def test_cleanup_per_host(self):
+        for i, host in enumerate(self.hosts):
+            self.run_process(host, f"proc{i}")
+            self.clients[host.pk].containers.list.return_value = []
+            self.clients[host.pk].networks.list.return_value = []
+        self.clients[self.hosts[0].pk].containers.list.return_value = [
+            mock.Mock(status="running", attrs={"Names": ["/proc0_vuln"], "Ports": []})
+        ]
+
+        models.ChallengeProcess.cleanup()
+
+        for host in self.hosts:
+            labelled = [
+                call
+                for call in self.clients[host.pk].containers.list.call_args_list
+                if "label" in call.kwargs["filters"]
+            ]
+            self.assertEqual(len(labelled), 1)
+        running = models.ChallengeProcess.running_challenges.values_list(
+            "process_identifier", flat=True
+        )
+        self.assertEqual(list(running), ["proc0"])
+
+    @mock.patch.object(models.ChallengeProcess, "_pull_images")
+    @mock.patch.object(
+        models.ChallengeProcess, "_create_environment", return_value=(None, [])
+    )
+    def test_pool_spread_over_hosts(self, _create_environment, _pull_images):
+        for host in self.hosts:
+            host.capacity = 3
+            host.save()
+        self.challenge.pool_size = 8
+        self.challenge.save()
+        self.run_process(self.hosts[1])
+
+        self.assertEqual(models.PooledInstance.fill(self.challenge), 5)
+        per_host = models.PooledInstance.objects.values_list("host").annotate(
+            n=Count("pk")
+        )
+        self.assertEqual(dict(per_host), {self.hosts[0].pk: 3, self.hosts[1].pk: 2})
@@ -0,0 +1,272 @@
+"""Searchable index of exam-proxy transcripts
+
+The exam-proxy appends every line a student sends (``->``) or receives
+(``<-``) to ``MEDIA_ROOT/logs/<process>/challenge.log``, quoted if it is
+valid UTF-8 and hex-encoded otherwise. Ingestion parses these files line
+by line into a SQLite database with an FTS5 trigram index, so payloads can
+be searched for any substring across all students. Logs compressed by
+:mod:`challenges.logs` are read as well.
+
+The index lives in its own SQLite file (``TRANSCRIPT_INDEX``) so it works
+regardless of the database backend. For every log it remembers up to which
+byte it was read, so repeated ingestion only parses what was appended.
+"""
+
+import binascii
+import sqlite3
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+from django.conf import settings
+
+from . import logs
+
+#: Marker the proxy writes when a connection sends its first byte
+FIRST_BYTE = b"** First byte read at "
+
+#: Rows inserted per transaction while ingesting a log
+BATCH_SIZE = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS logs (
+    process_identifier TEXT PRIMARY KEY,
+    offset INTEGER NOT NULL,
+    timestamp TEXT,
+    source TEXT
+);
+CREATE TABLE IF NOT EXISTS records (
+    id INTEGER PRIMARY KEY,
+    process_identifier TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    direction TEXT NOT NULL,
+    timestamp TEXT,
+    encoding TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    hex TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS records_process
+    ON records (process_identifier, offset);
+CREATE VIRTUAL TABLE IF NOT EXISTS records_fts USING fts5(
+    payload, hex, content='records', content_rowid='id', tokenize='trigram'
+);
+"""
+
+
+@dataclass
+class Record:
+    """A line of a transcript"""
+
+    process_identifier: str
+    offset: int
+    direction: str
+    #: Time of the latest connection, the proxy does not time single lines
+    timestamp: Optional[str]
+    encoding: str
+    payload: str
+    hex: str
+
+
+def parse_line(line: bytes):
+    """``(direction, encoding, payload bytes)`` of a transcript line
+
+    Returns ``None`` for lines that are not sent or received data.
+    """
+    line = line.rstrip(b"\n")
+    direction, _sep, data = line.partition(b" ")
+    if direction not in (b"->", b"<-"):
+        return None
+    if data.startswith(b'"') and data.endswith(b'"') and len(data) >= 2:
+        return direction.decode(), "utf8", data[1:-1]
+    if data.startswith(b"0x"):
+        try:
+            return direction.decode(), "hex", binascii.unhexlify(data[2:])
+        except (binascii.Error, ValueError):
+            pass
+    return direction.decode(), "raw", data
+
+
+def parse_transcript(file, process_identifier, offset=0, timestamp=None):
+    """Parse ``file`` from ``offset``, yielding records and where they end
+
+    Yields ``(record, end, timestamp)``, where ``record`` is ``None`` for
+    marker lines. A final line without a newline is still being written by the
+    proxy and is left for the next run.
+    """
+    file.seek(offset)
+    for line in file:
+        if not line.endswith(b"\n"):
+            return
+        start, offset = offset, offset + len(line)
+        if line.startswith(FIRST_BYTE):
+            timestamp = line[len(FIRST_BYTE) :].strip().decode()
+            yield None, offset, timestamp
+            continue
+        if (parsed := parse_line(line)) is None:
+            yield None, offset, timestamp
+            continue
+        direction, encoding, payload = parsed
+        record = Record(
+            process_identifier=process_identifier,
+            offset=start,
+            direction=direction,
+            timestamp=timestamp,
+            encoding=encoding,
+            payload=payload.decode(errors="backslashreplace"),
+            hex=payload.hex(),
+        )
+        yield record, offset, timestamp
+
+
+class TranscriptIndex:
+    """The SQLite database holding parsed transcripts"""
+
+    def __init__(self, path=None):
+        self.path = Path(path or settings.TRANSCRIPT_INDEX)
+        self.connection = sqlite3.connect(self.path)
+        self.connection.executescript(SCHEMA)
+        self._upgrade()
+
+    def _upgrade(self):
+        """Bring an index created by an older version up to date"""
+        columns = {row[1] for row in self.connection.execute("PRAGMA table_info(logs)")}
+        if "source" not in columns:
+            # Logs without a source are read again from their offset
+            with self.connection:
+                self.connection.execute("ALTER TABLE logs ADD COLUMN source TEXT")
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def position(self, process_identifier):
+        """``(offset, timestamp, source)`` up to which a log was ingested
+
+        ``source`` is the name and size of the file that was read, see
+        :meth:`ingest`.
+        """
+        row = self.connection.execute(
+            "SELECT offset, timestamp, source FROM logs WHERE process_identifier = ?",
+            (process_identifier,),
+        ).fetchone()
+        return row or (0, None, None)
+
+    def forget(self, process_identifier):
+        """Drop everything ingested from a log"""
+        with self.connection:
+            self.connection.execute(
+                "INSERT INTO records_fts(records_fts, rowid, payload, hex) "
+                "SELECT 'delete', id, payload, hex FROM records "
+                "WHERE process_identifier = ?",
+                (process_identifier,),
+            )
+            self.connection.execute(
+                "DELETE FROM records WHERE process_identifier = ?",
+                (process_identifier,),
+            )
+            self.connection.execute(
+                "DELETE FROM logs WHERE process_identifier = ?",
+                (process_identifier,),
+            )
+
+    def _insert(self, records, process_identifier, offset, timestamp, source):
+        with self.connection:
+            for record in records:
+                cursor = self.connection.execute(
+                    "INSERT INTO records (process_identifier, offset, direction, "
+                    "timestamp, encoding, payload, hex) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        record.process_identifier,
+                        record.offset,
+                        record.direction,
+                        record.timestamp,
+                        record.encoding,
+                        record.payload,
+                        record.hex,
+                    ),
+                )
+                self.connection.execute(
+                    "INSERT INTO records_fts(rowid, payload, hex) VALUES (?, ?, ?)",
+                    (cursor.lastrowid, record.payload, record.hex),
+                )
+            self.connection.execute(
+                "INSERT INTO logs (process_identifier, offset, timestamp, source) "
+                "VALUES (?, ?, ?, ?) ON CONFLICT (process_identifier) "
+                "DO UPDATE SET offset = excluded.offset, "
+                "timestamp = excluded.timestamp, source = excluded.source",
+                (process_identifier, offset, timestamp, source),
+            )
+
+    def ingest(self, process_identifier, path: Path) -> int:
+        """Add what was appended to the log at ``path``
+
+        ``path`` may be compressed, offsets always refer to the uncompressed
+        log. Returns the number of new records.
+        """
+        offset, timestamp, previous = self.position(process_identifier)
+        stat = path.stat()
+        current = f"{path.name}:{stat.st_size}"
+        if current == previous:
+            return 0
+        if not logs.is_compressed(path) and stat.st_size < offset:
+            # The log was replaced, start over
+            self.forget(process_identifier)
+            offset, timestamp = 0, None
+
+        count = 0
+        batch = []
+        end = offset
+        with logs.open_log(path) as f:
+            for record, end, timestamp in parse_transcript(
+                f, process_identifier, offset, timestamp
+            ):
+                if record is not None:
+                    batch.append(record)
+                if len(batch) >= BATCH_SIZE:
+                    self._insert(batch, process_identifier, end, timestamp, None)
+                    count += len(batch)
+                    batch = []
+        self._insert(batch, process_identifier, end, timestamp, current)
+        count += len(batch)
+        return count
+
+    def search(self, query: str, limit=100):
+        """Records whose payload or hex contains ``query``
+
+        The trigram index needs at least three characters.
+        """
+        if len(query) < 3:
+            raise ValueError("Search for at least three characters")
+        phrase = '"{}"'.format(query.replace('"', '""'))
+        rows = self.connection.execute(
+            "SELECT records.process_identifier, records.offset, direction, "
+            "timestamp, encoding, records.payload, records.hex "
+            "FROM records_fts JOIN records ON records.id = records_fts.rowid "
+            "WHERE records_fts MATCH ? "
+            "ORDER BY records.process_identifier, records.offset LIMIT ?",
+            (phrase, limit),
+        )
+        return [Record(*row) for row in rows]
+
+
+def transcript_logs(logdir=None):
+    """``(process identifier, path)`` of every transcript on disk"""
+    logdir = Path(logdir or logs.log_root())
+    if not logdir.is_dir():
+        return
+    for directory in sorted(logdir.iterdir()):
+        if (path := logs.find_log(directory)) is not None:
+            yield directory.name, path
+
+
+def ingest_all(index: TranscriptIndex, logdir=None):
+    """Ingest every transcript, returning the number of new records"""
+    return sum(
+        index.ingest(process_identifier, path)
+        for process_identifier, path in transcript_logs(logdir)
+    )
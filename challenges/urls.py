@@ -21,4 +21,9 @@ urlpatterns = [
         views.ChallengeProcessStopView.as_view(),
         name="delete-process",
     ),
+    path(
+        "process/job/<int:pk>/",
+        views.ChallengeJobStatusView.as_view(),
+        name="job",
+    ),
 ]
@@ -1,27 +1,23 @@
+import hashlib
+import math
 from html import unescape
 from typing import Dict
 
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.core.cache import cache
+from django.db.models import Count, Prefetch, Q
 from django.http import JsonResponse, Http404
 from django.views.generic import TemplateView, DetailView, View
 from django.views.generic.edit import CreateView
 from django.shortcuts import render, get_object_or_404
+from django.urls import reverse
 from django.conf import settings
 
-import markdown
 import bleach
 
 
-from . import models
-
-
-def markdownize(text):
-    if text is not None:
-        return markdown.markdown(
-            text,
-            extensions=["extra", "smarty", "codehilite"],
-        )
-    return ""
+from . import admission, models, ratelimit
+from .rendering import markdownize
 
 
 class ChallengeListView(TemplateView):
@@ -31,16 +27,16 @@ class ChallengeListView(TemplateView):
 
     def _format_challenge(self, challenge: models.Challenge) -> Dict:
         user = self.request.user
-        try:
-            if not user.is_anonymous:
-                user_entry = challenge.completed_entries.get(user=user)
-                finished = user_entry.completion_time is not None and user_entry.writeup
-            else:
-                user_entry = None
-                finished = None
-        except models.ChallengeEntry.DoesNotExist:
+        if not user.is_anonymous:
+            user_entry = next(iter(challenge.user_completed_entries), None)
+            finished = (
+                user_entry is not None
+                and user_entry.completion_time is not None
+                and user_entry.writeup
+            )
+        else:
             user_entry = None
-            finished = False
+            finished = None
 
         return {
             "obj": challenge,
@@ -54,6 +50,23 @@ class ChallengeListView(TemplateView):
             challenges = models.Challenge.objects.all()
         else:
             challenges = models.Challenge.available.all()
+        challenges = challenges.annotate(
+            started_count=Count("challengeentry"),
+            completed_count=Count(
+                "challengeentry",
+                filter=Q(challengeentry__completion_time__isnull=False),
+            ),
+        )
+        if not self.request.user.is_anonymous:
+            challenges = challenges.prefetch_related(
+                Prefetch(
+                    "challengeentry_set",
+                    queryset=models.ChallengeEntry.objects.filter(
+                        user=self.request.user, completion_time__isnull=False
+                    ),
+                    to_attr="user_completed_entries",
+                )
+            )
         context = super().get_context_data(*args, **kwargs)
         context["challenges"] = [
             self._format_challenge(challenge) for challenge in challenges
@@ -75,17 +88,47 @@ class ChallengeDetailView(LoginRequiredMixin, DetailView):
             context["user_entry"] = entry = self.object.challengeentry_set.get(
                 user=self.request.user
             )
-            context["processes"] = entry.challengeprocess_set.filter(running=True)
+            context["processes"] = entry.challengeprocess_set.filter(
+                running=True
+            ).select_related("host")
+            context["pending_job"] = entry.challengejob_set.filter(
+                action=models.ChallengeJob.START,
+                status__in=(models.ChallengeJob.QUEUED, models.ChallengeJob.RUNNING),
+            ).first()
+            if context["pending_job"] is not None:
+                context["queue_position"] = _job_data(context["pending_job"]).get(
+                    "position"
+                )
             context["writeup_html"] = markdownize(entry.writeup)
         except models.ChallengeEntry.DoesNotExist:
             context["user_entry"] = None
-        context["docker_host"] = settings.DOCKER_HOST
         context["description"] = markdownize(self.object.description)
         return context
 
 
 class SubmitFlag(LoginRequiredMixin, View):
+    """Checks submitted flags
+
+    Scripted guessing should not reach the database: every user gets
+    ``FLAG_RATE`` guesses per second per challenge with bursts of
+    ``FLAG_BURST``, and a wrong guess is answered from the cache for
+    ``FLAG_WRONG_CACHE`` seconds when it is repeated.
+    """
+
     def post(self, request, pk):
+        flag = request.POST.get("flag")
+        if flag is None or not flag.isascii():
+            return JsonResponse({"correct": False})
+        key = f"flag:{request.user.pk}:{pk}"
+        retry_after = ratelimit.take(key, settings.FLAG_RATE, settings.FLAG_BURST)
+        if retry_after:
+            return JsonResponse(
+                {"correct": False, "retry_after": math.ceil(retry_after)}, status=429
+            )
+        wrong_key = f"{key}:wrong:{hashlib.sha256(flag.encode()).hexdigest()}"
+        if cache.get(wrong_key):
+            return JsonResponse({"correct": False})
+
         challenge = get_object_or_404(models.Challenge, pk=pk)
         if not challenge.is_active and not request.user.is_superuser:
             raise Http404
@@ -93,23 +136,50 @@ class SubmitFlag(LoginRequiredMixin, View):
             challenge=challenge,
             user=request.user,
         )
-        flag = request.POST.get("flag")
-        return JsonResponse({"correct": entry.submit_flag(flag)})
+        correct = entry.submit_flag(flag)
+        if not correct:
+            cache.set(wrong_key, True, timeout=settings.FLAG_WRONG_CACHE)
+        return JsonResponse({"correct": correct})
 
 
 class SubmitWriteup(LoginRequiredMixin, View):
+    """Autosave of the writeup
+
+    The detail page saves a few seconds after every keystroke, which makes
+    this the busiest write path. Unchanged writeups are not written or
+    rendered again, and a user's saves are written at most once every
+    ``WRITEUP_SAVE_INTERVAL`` seconds; the page retries the others. The
+    interval is claimed with an atomic ``cache.add`` in the default cache,
+    which has to be shared by all workers for this to hold across them.
+    Saves with ``force`` are written anyway, as the page sends them right
+    before it reloads and could not retry.
+    """
+
     def post(self, request, pk):
         challenge = get_object_or_404(models.Challenge, pk=pk)
         if not challenge.is_active and not request.user.is_superuser:
             raise Http404
-        entry, _new = models.ChallengeEntry.objects.get_or_create(
-            challenge=challenge,
-            user=request.user,
-        )
         writeup = request.POST.get("writeup")
         if writeup is None:
             return JsonResponse({"error": "no writeup included"}, status=400)
-        entry.writeup = writeup = unescape(
+
+        state_key = f"writeup:{request.user.pk}:{challenge.pk}"
+        digest = hashlib.sha256(writeup.encode()).hexdigest()
+        state = cache.get(state_key)
+        if state is not None and state["digest"] == digest:
+            return JsonResponse(
+                {"saved": True, "preview_html": markdownize(state["writeup"])}
+            )
+
+        claimed = cache.add(
+            f"{state_key}:saved", True, timeout=settings.WRITEUP_SAVE_INTERVAL
+        )
+        if not claimed and not request.POST.get("force"):
+            return JsonResponse(
+                {"saved": False, "retry_after": settings.WRITEUP_SAVE_INTERVAL}
+            )
+
+        cleaned = unescape(
             bleach.clean(
                 writeup,
                 attributes=bleach.sanitizer.ALLOWED_ATTRIBUTES,
@@ -117,8 +187,19 @@ class SubmitWriteup(LoginRequiredMixin, View):
                 strip=True,
             )
         )
-        entry.save()
-        return JsonResponse({"preview_html": markdownize(writeup)})
+        entries = models.ChallengeEntry.objects.filter(
+            challenge=challenge, user=request.user
+        )
+        if not entries.update(writeup=cleaned):
+            _entry, new = models.ChallengeEntry.objects.get_or_create(
+                challenge=challenge,
+                user=request.user,
+                defaults={"writeup": cleaned},
+            )
+            if not new:
+                entries.update(writeup=cleaned)
+        cache.set(state_key, {"digest": digest, "writeup": cleaned}, 3600)
+        return JsonResponse({"saved": True, "preview_html": markdownize(cleaned)})
 
 
 class ChallengeProcessCreateView(LoginRequiredMixin, View):
@@ -130,8 +211,8 @@ class ChallengeProcessCreateView(LoginRequiredMixin, View):
             challenge=challenge,
             user=request.user,
         )
-        models.ChallengeProcess.start(entry)
-        return JsonResponse({"started": True})
+        job = models.ChallengeJob.enqueue_start(entry)
+        return JsonResponse(_job_data(job))
 
 
 class ChallengeProcessStopView(LoginRequiredMixin, View):
@@ -139,5 +220,29 @@ class ChallengeProcessStopView(LoginRequiredMixin, View):
         process = get_object_or_404(
             models.ChallengeProcess, pk=pk, challenge_entry__user=request.user
         )
+        job = models.ChallengeJob.enqueue_stop(
+            process, challenge_entry=process.challenge_entry
+        )
+        # Already queued, so the delete signal does not need to stop it
+        process.running = False
         process.delete()
-        return JsonResponse({"stopped": True})
+        return JsonResponse(_job_data(job))
+
+
+def _job_data(job: models.ChallengeJob) -> Dict:
+    data = {
+        "job": job.pk,
+        "status": job.status,
+        "status_url": reverse("challenges:job", kwargs={"pk": job.pk}),
+    }
+    if job.action == job.START and job.status == job.QUEUED:
+        data["position"] = admission.queue_position(job)
+    return data
+
+
+class ChallengeJobStatusView(LoginRequiredMixin, View):
+    def get(self, request, pk):
+        job = get_object_or_404(
+            models.ChallengeJob, pk=pk, challenge_entry__user=request.user
+        )
+        return JsonResponse(_job_data(job))
@@ -101,9 +101,42 @@ DATABASES = {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": os.path.join(BASE_DIR, "db.sqlite3"),
         "OPTIONS": {"timeout": 20},
+        # Not in memory, so collectresults workers can open it in tests
+        "TEST": {"NAME": os.path.join(BASE_DIR, "test_db.sqlite3")},
     }
 }
 
+# Cache
+# https://docs.djangoproject.com/en/4.0/topics/cache/
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "markdown": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "markdown",
+        "TIMEOUT": None,
+        "OPTIONS": {"MAX_ENTRIES": 2000},
+    },
+}
+
+# Cache for rendered markdown, keyed by the hash of the text
+MARKDOWN_CACHE = "markdown"
+
+# Seconds between writes of a user's autosaved writeup. Coalescing only
+# works across uWSGI workers if the default cache is shared, like the
+# memcached cache in production_settings.
+WRITEUP_SAVE_INTERVAL = 5
+
+# Flag guesses per second a user may submit for a challenge, with bursts
+# of FLAG_BURST, and seconds a wrong guess is remembered. Like the writeup
+# interval, these are per uWSGI worker unless the default cache is shared;
+# production_settings uses memcached.
+FLAG_RATE = 1
+FLAG_BURST = 5
+FLAG_WRONG_CACHE = 60
+
 # User model
 # https://docs.djangoproject.com/en/3.0/topics/auth/customizing/#substituting-a-custom-user-model
 AUTH_USER_MODEL = "users.User"
@@ -156,10 +189,59 @@ LOGIN_REDIRECT_URL = "/"
 
 EMAIL_BACKEND = "django.core.mail.backends.console.EmailBackend"
 
+# Name students connect to for processes on the default Docker host, that is
+# the daemon from the environment; registered Docker hosts have their own
 DOCKER_HOST = "localhost"
 CONTAINER_NAMESPACE = "eu.gcr.io/hacking-in-c"
 PROXY_CONTAINER = "eu.gcr.io/hacking-in-c/exam-proxy"
 
+# Label on all docker objects we create; must be unique per site on a host
+DEPLOYMENT_NAME = "ctfexam"
+
+# Connections each worker process keeps open to the Docker daemon
+DOCKER_MAX_POOL_SIZE = 10
+# Docker calls a single start or teardown makes at the same time
+DOCKER_PARALLELISM = 8
+
+# Idle network pairs that fill_pool prepares, and the most we keep around
+NETWORK_POOL_SIZE = 20
+NETWORK_POOL_MAX_IDLE = 50
+
+# Seconds before launches check the registry for a newer image again
+IMAGE_CACHE_TTL = 15 * 60
+
+# Limits on what running processes may reserve together: CPUs, bytes of
+# memory, PIDs and Docker networks. None means no limit. Starts that do not
+# fit wait in the job queue, with a fair share per user.
+ADMISSION_CPU = None
+ADMISSION_MEMORY = None
+ADMISSION_PIDS = None
+ADMISSION_SUBNETS = None
+# Stop processes whose transcript was idle for this many seconds when a
+# start does not fit; None never stops processes for room.
+ADMISSION_EVICT_IDLE = None
+
+# SQLite database with the searchable index of exam-proxy transcripts.
+# Keep it outside MEDIA_ROOT, which is served publicly.
+TRANSCRIPT_INDEX = BASE_DIR / "transcripts.sqlite3"
+
+# Logs of stopped processes are compressed once nothing was written to them
+# for LOG_COMPRESS_AFTER seconds. Log directories older than LOG_MAX_AGE
+# seconds are removed, then the oldest ones while all logs together take
+# more than LOG_MAX_TOTAL_SIZE bytes. Set LOG_COMPRESS_AFTER to None to leave
+# logs uncompressed, the other two to None to keep logs.
+LOG_COMPRESS_AFTER = 10 * 60
+LOG_MAX_AGE = 180 * 24 * 60 * 60
+LOG_MAX_TOTAL_SIZE = 20 * 1024**3
+
+# Number of start/stop jobs the process_jobs worker runs concurrently
+JOB_WORKERS = 4
+# Seconds between checks for new jobs
+JOB_POLL_INTERVAL = 1
+# Running jobs are retried by another worker when the worker running them
+# has not renewed their lease for this many seconds
+JOB_LEASE = 60
+
 
 VALID_STUDENT_NUMBERS = None
 
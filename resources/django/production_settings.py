@@ -7,6 +7,7 @@ BASE_DIR = Path(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 MEDIA_ROOT = BASE_DIR / ".." / "media"
 STATIC_ROOT = BASE_DIR / ".." / "static"
+TRANSCRIPT_INDEX = BASE_DIR / ".." / "transcripts.sqlite3"
 
 DEBUG = False
 
@@ -48,6 +49,21 @@ DATABASES = {
     },
 }
 
+# The default cache is shared by all uWSGI workers, so flag rate limits,
+# remembered wrong guesses and writeup autosave coalescing hold across them
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.memcached.PyMemcacheCache",
+        "LOCATION": "127.0.0.1:11211",
+    },
+    "markdown": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "markdown",
+        "TIMEOUT": None,
+        "OPTIONS": {"MAX_ENTRIES": 2000},
+    },
+}
+
 if "SENTRY_DSN" in os.environ:
     import sentry_sdk
     from sentry_sdk.integrations.django import DjangoIntegration
@@ -1,14 +1,15 @@
 from django.db import models
 from django.core.exceptions import ValidationError
 from django.contrib.auth.models import AbstractUser
-from django.conf import settings
+
+from .roster import get_roster
 
 # Create your models here.
 
 
 def validate_student_number(student_number):
-    if (numbers := settings.VALID_STUDENT_NUMBERS) is not None:
-        if student_number.lower() not in numbers:
+    if (roster := get_roster()) is not None:
+        if student_number not in roster:
             raise ValidationError("This is not a known student number")
 
 
@@ -0,0 +1,100 @@
+"""Index over the student numbers in ``VALID_STUDENT_NUMBERS``
+
+Validation needs a set instead of a list, and looking for student numbers
+in writeups should not scan every text once per student. The index builds
+an Aho-Corasick automaton over all numbers and their variants without the
+leading letter, which finds every occurrence in a single pass.
+"""
+
+from collections import deque
+
+from django.conf import settings
+
+
+class RosterIndex:
+    """Student numbers, with a matcher for finding them in text"""
+
+    def __init__(self, student_numbers):
+        #: Student numbers in roster order, lower case
+        self.numbers = list(dict.fromkeys(number.lower() for number in student_numbers))
+        self._positions = {number: i for i, number in enumerate(self.numbers)}
+
+        # Trie as a list of transition tables; outputs are (number, is_full)
+        self._goto = [{}]
+        self._outputs = [[]]
+        for number in self.numbers:
+            self._add_pattern(number, (number, True))
+            self._add_pattern(number[1:], (number, False))
+        self._fail = [0] * len(self._goto)
+        self._link_failures()
+
+    def _add_pattern(self, pattern, output):
+        if not pattern:
+            return
+        state = 0
+        for char in pattern:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto.append({})
+                self._outputs.append([])
+                self._goto[state][char] = next_state
+            state = next_state
+        self._outputs[state].append(output)
+
+    def _link_failures(self):
+        """Breadth-first pass setting the failure link of every state"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(char, 0)
+                self._fail[next_state] = target if target != next_state else 0
+                self._outputs[next_state].extend(self._outputs[self._fail[next_state]])
+
+    def __contains__(self, student_number):
+        return student_number.lower() in self._positions
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def matches(self, text):
+        """Student numbers occurring in ``text``
+
+        Returns the numbers found in full and the numbers of which only the
+        part after the leading letter was found, both in roster order.
+        """
+        goto = self._goto
+        fail = self._fail
+        outputs = self._outputs
+        full = set()
+        partial = set()
+        state = 0
+        for char in text.lower():
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for number, is_full in outputs[state]:
+                (full if is_full else partial).add(number)
+        key = self._positions.__getitem__
+        return sorted(full, key=key), sorted(partial, key=key)
+
+
+_index = None
+_indexed_numbers = None
+
+
+def get_roster():
+    """The index of ``VALID_STUDENT_NUMBERS``, or None if it is not set"""
+    global _index, _indexed_numbers
+    numbers = settings.VALID_STUDENT_NUMBERS
+    if numbers is None:
+        return None
+    if numbers is not _indexed_numbers:
+        _index = RosterIndex(numbers)
+        _indexed_numbers = numbers
+    return _index
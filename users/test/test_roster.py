@@ -0,0 +1,34 @@
+from django.core.exceptions import ValidationError
+from django.test import SimpleTestCase, override_settings
+
+from users.models import validate_student_number
+from users.roster import RosterIndex
+
+
+class RosterIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.roster = RosterIndex(["s1234567", "S7654321", "e1234560"])
+
+    def test_membership(self):
+        self.assertIn("S1234567", self.roster)
+        self.assertIn("s7654321", self.roster)
+        self.assertNotIn("s0000000", self.roster)
+
+    def test_matches(self):
+        full, partial = self.roster.matches(
+            "Worked with E1234560 and s7654321, see 12345670"
+        )
+        self.assertEqual(full, ["s7654321", "e1234560"])
+        self.assertEqual(partial, ["s1234567", "s7654321", "e1234560"])
+
+    def test_overlapping_matches(self):
+        full, _partial = self.roster.matches("s1234567654321")
+        self.assertEqual(full, ["s1234567"])
+        _full, partial = RosterIndex(["a1234", "b2345"]).matches("12345")
+        self.assertEqual(partial, ["a1234", "b2345"])
+
+    @override_settings(VALID_STUDENT_NUMBERS=["s1234567"])
+    def test_validation(self):
+        validate_student_number("S1234567")
+        with self.assertRaises(ValidationError):
+            validate_student_number("s7654321")